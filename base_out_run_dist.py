@@ -1,54 +1,64 @@
-import numpy as np, polars as pl, matplotlib.pyplot as plt
+import numpy as np, polars as pl, argparse
+from run_distribution import runs_to_end_of_inning
+from utils import scan_retrosheet
+from table_store import open_table, save_table
 cl = pl.col; rng = np.random.default_rng()
 
-# Read in the data, 
-# get regular seasons batting events before the 9th inning
-# calculate the rest of the inning runs
-# find the distribution of runs scored given base out state
-df = pl.scan_parquet('data/2021-2024-full-retrosheet.parquet')
-df = (df.rename({i: i.lower() for i in df.collect_schema().names()})
-        .filter(cl('game_type').eq('R'),cl('bat_event_fl').eq('T'),cl('inn_ct')<9)
-        .sort('game_id','inn_ct','bat_home_id','event_id')
-        .with_columns(rest_inn_runs=cl('fate_runs_ct')+cl('event_runs_ct'))
-        .group_by('start_bases_cd','outs_ct','rest_inn_runs')
-        .agg(pl.len().alias('n'))
-        .sort('outs_ct','start_bases_cd','rest_inn_runs')
-        .with_columns(p=cl('n')/(cl('n').sum().over('start_bases_cd','outs_ct')))
-        .collect())
+# retrosheet columns the run distributions need
+retro_cols = ['game_type','bat_event_fl','inn_ct','game_id','bat_home_id','event_id',
+              'fate_runs_ct','event_runs_ct','start_bases_cd','outs_ct',
+              'start_bat_score_ct','start_fld_score_ct']
 
-# Build up the numpy matrix from the dataframe
-m = np.zeros((8,3,15))
-for i in range(m.shape[0]):
-    for j in range(m.shape[1]):
-        ind,p = df.filter(cl('start_bases_cd').eq(i),cl('outs_ct').eq(j)).select('rest_inn_runs','p').to_numpy().T
-        m[i,j,ind.astype(int)] = p
+def run_dist_matrix(df):
+    ''' p(rest of inning runs | base, outs) as an (8,3,15) matrix from a frame of batting events
+    '''
+    df = (df.sort('game_id','inn_ct','bat_home_id','event_id')
+            .with_columns(rest_inn_runs=cl('fate_runs_ct')+cl('event_runs_ct'))
+            .group_by('start_bases_cd','outs_ct','rest_inn_runs')
+            .agg(pl.len().alias('n'))
+            .sort('outs_ct','start_bases_cd','rest_inn_runs')
+            .with_columns(p=cl('n')/(cl('n').sum().over('start_bases_cd','outs_ct')))
+            .collect())
 
-np.save('tables/p(runs|base,out).npy',m)
+    # Build up the numpy matrix from the dataframe
+    m = np.zeros((8,3,15))
+    for i in range(m.shape[0]):
+        for j in range(m.shape[1]):
+            ind,p = df.filter(cl('start_bases_cd').eq(i),cl('outs_ct').eq(j)).select('rest_inn_runs','p').to_numpy().T
+            m[i,j,ind.astype(int)] = p
+    return m
 
-# Do the same thing but for 9th inning or greater, 
-# when the batting team needs only 1 run to tie or win the game
-# (I'm assuming that teams behave differently in these scenarios)
-df = pl.scan_parquet('data/2021-2024-full-retrosheet.parquet')
-df = (df.rename({i: i.lower() for i in df.collect_schema().names()})
-        .filter(cl('game_type').eq('R'),cl('bat_event_fl').eq('T'),cl('inn_ct')>=9)
-        .sort('game_id','inn_ct','bat_home_id','event_id')
-        .with_columns(bat_deficit=cl('start_bat_score_ct')-cl('start_fld_score_ct'))
-        .filter(cl('bat_deficit').is_in([0,-1]))
-        .with_columns(rest_inn_runs=cl('fate_runs_ct')+cl('event_runs_ct'))
-        .group_by('start_bases_cd','outs_ct','rest_inn_runs')
-        .agg(pl.len().alias('n'))
-        .sort('outs_ct','start_bases_cd','rest_inn_runs')
-        .with_columns(p=cl('n')/(cl('n').sum().over('start_bases_cd','outs_ct')))
-        .collect())
+def empirical_run_dists(retro):
+    ''' p(runs|base,out) & p(runs|base,out,need1) from a (lowercased) retrosheet frame
+    '''
+    # get regular seasons batting events before the 9th inning
+    # calculate the rest of the inning runs
+    # find the distribution of runs scored given base out state
+    pr = run_dist_matrix(retro.filter(cl('game_type').eq('R'),cl('bat_event_fl').eq('T'),cl('inn_ct')<9))
 
-# Build up the numpy matrix from this dataframe
-m = np.zeros((8,3,15))
-for i in range(m.shape[0]):
-    for j in range(m.shape[1]):
-        ind,p = df.filter(cl('start_bases_cd').eq(i),cl('outs_ct').eq(j)).select('rest_inn_runs','p').to_numpy().T
-        m[i,j,ind.astype(int)] = p
+    # Do the same thing but for 9th inning or greater, 
+    # when the batting team needs only 1 run to tie or win the game
+    # (I'm assuming that teams behave differently in these scenarios)
+    pr9 = run_dist_matrix(retro.filter(cl('game_type').eq('R'),cl('bat_event_fl').eq('T'),cl('inn_ct')>=9)
+                               .with_columns(bat_deficit=cl('start_bat_score_ct')-cl('start_fld_score_ct'))
+                               .filter(cl('bat_deficit').is_in([0,-1])))
+    return pr, pr9
 
-np.save('tables/p(runs|base,out,need1).npy',m)
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser()
+    parser.add_argument('--from-transitions',action='store_true',
+                        help='derive p(runs|base,out) from the transition matrix instead of retrosheet')
+    args = parser.parse_args()
+
+    # exact runs to the end of the inning under the event model in transition_matrix.py, no retrosheet scan.
+    # the need1 table is only about how late game innings are actually played, so it's left alone
+    if args.from_transitions:
+        T = open_table('transition')
+        save_table('run_dist',runs_to_end_of_inning(T,max_runs=14))
+    else:
+        pr, pr9 = empirical_run_dists(scan_retrosheet(columns=retro_cols))
+        save_table('run_dist',pr)
+        save_table('run_dist_need1',pr9)
 
 
 ''' scratch work, please ignore
@@ -0,0 +1,76 @@
+import polars as pl, duckdb, pathlib, shutil, os, time, argparse
+import leaderboard
+cl = pl.col
+
+''' Rewrites closed seasons of data/daily_data (one small file per date) into one file per season, data/season_data/{year}.parquet,
+    sorted by resp_fielder_id & game_date with min/max stats per row group, so a fielder's plays sit in a couple of row groups
+    compact(year) also folds in partitions written for an already compacted season (rerun-xwp.py, historical_xwp.py),
+    those dates replace the season file's rows & the partitions get removed
+    python compact.py                 every closed season with daily partitions
+    python compact.py --seasons 2024
+'''
+
+here       = pathlib.Path(__file__).resolve().parent
+daily_dir  = here / 'data' / 'daily_data'
+season_dir = here / 'data' / 'season_data'
+row_group_size = 16384 # ~8 per season, a fielder's plays stay within 1-2 of them
+
+def season_path(year):
+    return season_dir / f"{year}.parquet"
+
+def compacted_seasons():
+    return sorted(int(p.stem) for p in season_dir.glob('*.parquet'))
+
+def read_daily(year):
+    ''' every partition of a season as one frame, None if there aren't any '''
+    if not list(daily_dir.glob(f"game_year={year}/*/*.parquet")):
+        return None
+    return duckdb.sql(f"""
+        select *
+        from read_parquet('{daily_dir}/game_year={year}/*/*.parquet',
+                          hive_partitioning=True,
+                          union_by_name=True)
+    """).pl()
+
+def read_date(year, date):
+    ''' the plays on a date, from its partition or from the season file if the season's compacted '''
+    frames = []
+    part = daily_dir / f"game_year={year}" / f"game_date={date}"
+    if part.exists():
+        frames.append(pl.read_parquet(part / '*.parquet').with_columns(game_year=pl.lit(year,pl.Int64),game_date=pl.lit(date)))
+    elif season_path(year).exists():
+        frames.append(pl.scan_parquet(season_path(year)).filter(cl('game_date').eq(date)).collect())
+    return pl.concat(frames,how='diagonal_relaxed') if frames else None
+
+def compact(year):
+    ''' fold the season's partitions into its season file '''
+    t0 = time.perf_counter()
+    new = read_daily(year)
+    if new is None:
+        return
+    df = new
+    if season_path(year).exists():
+        old = pl.read_parquet(season_path(year)).filter(~cl('game_date').is_in(new['game_date'].unique().implode()))
+        df = pl.concat([old,new],how='diagonal_relaxed')
+    df = df.sort('resp_fielder_id','game_date',nulls_last=True)
+
+    season_dir.mkdir(parents=True,exist_ok=True)
+    tmp = season_path(year).with_suffix('.tmp')
+    df.write_parquet(tmp,statistics=True,row_group_size=row_group_size)
+    os.replace(tmp,season_path(year))
+    # a crash before this just leaves partitions that the next compact(year) folds in again
+    shutil.rmtree(daily_dir / f"game_year={year}")
+    print(f"{year}: {new['game_date'].n_unique()} dates ({len(new)} plays) into {season_path(year).name}, "
+          f"{len(df)} plays in {time.perf_counter()-t0:.1f}s")
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser()
+    parser.add_argument('--seasons',type=int,nargs='*',help='default every closed season with daily partitions')
+    args = parser.parse_args()
+    seasons = args.seasons or sorted(int(p.name.split('=')[1]) for p in daily_dir.glob('game_year=*')
+                                     if int(p.name.split('=')[1])<int(time.strftime('%Y')))
+    for year in seasons:
+        compact(year)
+    con = duckdb.connect(here / 'data' / 'leaderboard.duckdb')
+    leaderboard.create_view(con) # the view lists the season files it reads
+    con.close()
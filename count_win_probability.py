@@ -0,0 +1,110 @@
+import numpy as np, polars as pl
+from leverage_index import next_state_list
+from transition_matrix import transition_components
+cl = pl.col
+
+''' Win prob at every count, wp_count[inn,half,base,outs,balls,strikes,rdiff]
+    A plate appearance ends in a strikeout, a walk/HBP or a ball in play, the base-out table (wp) values
+    wherever the transition matrix sends each of those. Inside the PA each pitch is a ball, strike, foul,
+    ball in play or HBP with count dependent probabilities (from retrosheet pitch sequences), so
+    the count values come from a 12 step backward pass over the counts, vectorized over everything else.
+    float32, (10,2,8,3,4,3,61) is ~1.4MB & lives in the table store like the other tables
+'''
+
+pitch_kinds = ('ball','strike','foul','in_play','hbp')
+
+# retrosheet pitch codes, anything else (pickoffs, no pitch, unknown, ...) isn't a pitch
+pitch_codes = {'B':'ball','I':'ball','P':'ball','V':'ball',
+               'C':'strike','S':'strike','T':'strike','M':'strike','Q':'strike','K':'strike',
+               'L':'strike','O':'strike', # bunted fouls are strikes even with 2 strikes
+               'F':'foul','R':'foul',
+               'X':'in_play','Y':'in_play',
+               'H':'hbp'}
+
+# retrosheet columns the pitch probabilities need
+retro_cols = ['game_type','bat_event_fl','pitch_seq_tx']
+
+def pitch_probs(retro):
+    ''' p(pitch kind | balls, strikes), shape (4, 3, 5) from the pitch sequences of regular season PAs '''
+    df = (retro.filter(cl('game_type').eq('R'),cl('bat_event_fl').eq('T'),cl('pitch_seq_tx').str.len_chars()>0)
+               .select(pitch=cl('pitch_seq_tx').str.extract_all('[A-Z]'))
+               .with_row_index('pa')
+               .explode('pitch')
+               .with_columns(kind=cl('pitch').replace_strict(pitch_codes,default=None))
+               .drop_nulls('kind')
+               .with_columns(is_ball=cl('kind').eq('ball'),
+                             is_strike=cl('kind').is_in(['strike','foul']))
+               # the count before each pitch, fouls stop counting at 2 strikes
+               .with_columns(balls=cl('is_ball').cum_sum().over('pa')-cl('is_ball'),
+                             strikes=(cl('is_strike').cum_sum().over('pa')-cl('is_strike')).clip(0,2))
+               .filter(cl('balls')<=3)
+               .group_by('balls','strikes','kind')
+               .agg(pl.len().alias('n'))
+               .collect())
+    n = np.zeros((4,3,len(pitch_kinds)))
+    n[df['balls'].to_numpy(),df['strikes'].to_numpy(),
+      [pitch_kinds.index(k) for k in df['kind']]] = df['n'].to_numpy()
+    return n/n.sum(-1,keepdims=True)
+
+def expected_next_wp(wp, T, p_xiw):
+    ''' E[wp once the PA is over] for every (inn,half,base,outs,rdiff), when the PA moves base-out states by T
+        half innings hand over the way they do in win_probability_solver.py, three outs in the bottom
+        of the last inning (or extras) ends the game, or with it tied it's worth the extras win% p_xiw
+    '''
+    n_inn, n_half, n_b, n_o, n_r = wp.shape
+    max_rdiff = (n_r-1)//2
+    new_base, new_outs, runs, p = next_state_list(T)
+
+    inn   = np.arange(n_inn)[:,None,None,None,None,None]
+    half  = np.arange(n_half)[None,:,None,None,None,None]
+    rdiff = np.arange(-max_rdiff,max_rdiff+1)[None,None,None,None,:,None]
+    new_base, new_outs, runs, p = (a[None,None,:,:,None,:] for a in (new_base,new_outs,runs,p))
+
+    next_rdiff = rdiff+np.where(half==1,runs,-runs) # home team contribs positively
+    three_outs = new_outs==3
+    next_half  = np.where(three_outs,1-half,half)
+    next_inn   = np.where(three_outs & (half==1),inn+1,inn).clip(0,n_inn-1)
+    next_base  = np.where(three_outs,np.where(inn==n_inn-1,2,0),new_base) # the bottom of extras starts with a runner on second
+    wp_next    = wp[next_inn,next_half,next_base,new_outs%3,next_rdiff.clip(-max_rdiff,max_rdiff)+max_rdiff]
+    game_over  = three_outs & (half==1) & (inn>=n_inn-2)
+    final      = np.where(next_rdiff==0,p_xiw,next_rdiff>0)
+    return (np.where(game_over,final,wp_next)*p).sum(-1)
+
+def count_layer(V_k, V_bb, V_ip, p_pitch):
+    ''' values at each count (..., 4, 3) from the values after a strikeout, walk/HBP & ball in play
+        fouls with 2 strikes keep the count, so that row is solved in closed form
+    '''
+    W = np.zeros(V_k.shape+(4,3))
+    for b in range(3,-1,-1):
+        for s in range(2,-1,-1):
+            p_ball, p_strike, p_foul, p_ip, p_hbp = p_pitch[b,s]
+            after_ball = V_bb if b==3 else W[...,b+1,s]
+            if s==2:
+                W[...,b,s] = (p_ball*after_ball + p_strike*V_k + p_ip*V_ip + p_hbp*V_bb)/(1-p_foul)
+            else:
+                W[...,b,s] = p_ball*after_ball + (p_strike+p_foul)*W[...,b,s+1] + p_ip*V_ip + p_hbp*V_bb
+    return W
+
+def count_wp_table(wp, p_pitch, p_outcomes, p_xiw, base_adv):
+    ''' wp_count, float32 (inn, half, base, outs, balls, strikes, rdiff)
+        p_outcomes is p(out,1b,2b,3b,hr | in play), see transition_matrix.event_probs,
+        p_xiw the extras win% the wp table was built with
+    '''
+    T_k, T_bb, T_bip = transition_components(base_adv)
+    T_ip = np.tensordot(np.asarray(p_outcomes),T_bip,axes=(-1,0))
+    V_k, V_bb, V_ip = (expected_next_wp(wp,T,p_xiw) for T in (T_k,T_bb,T_ip))
+    W = count_layer(V_k,V_bb,V_ip,p_pitch)              # (inn,half,base,outs,rdiff,balls,strikes)
+    return np.moveaxis(W,4,-1).astype('f')
+
+if __name__ == '__main__':
+    import model_registry as models
+    from utils import scan_retrosheet
+    import transition_matrix, win_probability_table
+    from table_store import open_table, save_table
+
+    retro = scan_retrosheet(columns=sorted({*retro_cols,*transition_matrix.retro_cols,
+                                            *win_probability_table.retro_cols})).collect().lazy()
+    _, p_outcomes = transition_matrix.event_probs(retro)
+    p_xiw = win_probability_table.extra_inning_win_prob(retro)
+    wpc = count_wp_table(open_table('wp'),pitch_probs(retro),p_outcomes,p_xiw,models.get('base_adv_no_sc'))
+    save_table('wp_count',wpc)
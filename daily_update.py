@@ -1,14 +1,13 @@
-import numpy as np, polars as pl, requests, json, pathlib, pickle as pkl, duckdb
-from catboost import CatBoostClassifier
-from data_scripts.statcast import get_statcast, add_playids
+import numpy as np, polars as pl, requests, json, pathlib, duckdb, sys, time, argparse
+import model_registry as models, leaderboard, compact
+from data_scripts.statcast import get_statcast, add_playids, find_missing_gamepks
 from data_scripts.outfield import retrieve_of_plays
 from data_scripts.player_info import get_player_bios
 from data_scripts.wall import calc_wall_properties
-from expected_win_probability import row_wise_xwp
+from expected_win_probability import batch_xwp, xwp_fingerprint
+from table_store import gather_state
 cl = pl.col
 data_dir = pathlib.Path('data')
-table_dir = pathlib.Path('tables')
-model_dir = pathlib.Path('models')
 
 # base state to int mapper
 bit_mapper = {'---': 0b000,
@@ -21,7 +20,6 @@ bit_mapper = {'---': 0b000,
               '111': 0b111}
 
 # column lists for prettier polars
-game_state   = ['inn_ind','half_ind','base_cd','outs_when_up','run_diff']
 positions    = ['pitcher', 'catcher', 
                'first base', 'second base', 'third base', 'shortstop',
                'left(?:-| )field', 'center(?:-| )field', 'right(?:-| )field']
@@ -30,12 +28,25 @@ outs         = ['double_play','sac_bunt_dboule_play','fielders_choice',
                 'fielders_choice_out','field_out','sac_fly_double_play','triple_play','sac_fly']
 fielder_cols = [f'fielder_{i}' for i in range(2,10)]
 
-sc_df     = get_statcast() # load statcast data
-df        = add_playids(sc_df) # add play_ids to it
+parser = argparse.ArgumentParser()
+parser.add_argument('--refresh',action='store_true',help='re-fetch play_ids even for games in the play_id cache')
+parser.add_argument('--full',action='store_true',help='reprocess every game since the oldest missing one, not just the missing ones')
+args = parser.parse_args()
+
+# nothing to do if every finished game this season is already in the db
+missing_gpks = find_missing_gamepks(time.strftime('%Y'))
+if not missing_gpks:
+    print('no new games')
+    sys.exit()
+print(f"{len(missing_gpks)} new games")
+
+sc_df     = get_statcast(None if args.full else missing_gpks) # load statcast data, only the new games
+if sc_df.is_empty(): # statcast can publish a game late (or never), nothing to do until it shows up
+    print(f"statcast has none of the {len(missing_gpks)} new games yet")
+    sys.exit()
+df        = add_playids(sc_df,refresh=args.refresh) # add play_ids to it (cached per game)
 of_plays  = retrieve_of_plays(df) # grab outfield plays for all outfielders in the sc data
 fences_df = pl.read_parquet(f'{data_dir}/fences-lidar.parquet') # get fence lidar measurements
-wp_df     = pl.scan_parquet(f'{table_dir}/p(win|inn,half,base,out,rdiff).parquet') # get win prob table
-li_df     = pl.scan_parquet(f'{table_dir}/leverage-index.parquet') # get leverage index table
 
 # make the df lazy for some speedups
 df = df.lazy()
@@ -99,9 +110,9 @@ df = (df.with_columns(game_date=cl('game_date').dt.date(),
                                       cl('fullName').alias('resp_fielder_name'),
                                       cl('birthDate').alias('resp_fielder_bday')),
               on='resp_fielder_id')
-        .join(wp_df,on=game_state,how='left')
-        .join(li_df,on=game_state,how='left')
-        .join(wp_df.rename({'wp':'next_wp'}),left_on=[f"next_{i}" for i in game_state],right_on=game_state,how='left')
+        .with_columns(wp = gather_state('wp'), # straight from the tables, null off the edge of them
+                      li = gather_state('li'),
+                      next_wp = gather_state('wp',prefix='next_'))
         .with_columns(next_wp = pl.when(cl('next_wp').is_not_null()).then('next_wp')
                                   .when((cl('post_home_score')-cl('post_away_score'))>0).then(pl.lit(1.))
                                   .when((cl('post_home_score')-cl('post_away_score'))<0).then(pl.lit(0.))
@@ -120,23 +131,17 @@ df = (df.with_columns(game_date=cl('game_date').dt.date(),
                 'catch_rate', 'angle', 'dist', 'wall_dist_start', 'wall_dist_land', 
                 'wall_dist_ball_dir', 'wall_min_dist', 'wall_height'))
 
-# load in the models
-with open(model_dir / 'outcome-given-hit.pkl','rb') as f: 
-    outcome_given_hit = pkl.load(f)
+# models & win prob table, loaded on first use
+outcome_given_hit = models.get('outcome_given_hit')
+catch_prob        = models.get('catch_prob') # OF catch prob model
+out_prob          = models.get('out_prob') # IF out prob model
+base_adv          = models.get('base_adv') # Baserunner advancement model
+wp_table          = models.get('wp_table')
 
-# OF catch prob model
-with open(model_dir / 'catch-prob.pkl','rb') as f: 
-    catch_prob = pkl.load(f)
-
-# IF out prob model
-with open(model_dir / 'out-prob.pkl','rb') as f: 
-    out_prob = pkl.load(f)
-
-# Baserunner advancement model
-base_adv = CatBoostClassifier().load_model(model_dir / 'baserunner-advancement.cbm')
-
-# win prob table
-wp_table = np.load(table_dir / 'p(win|inn,half,base,out,rdiff).npy')
+# model/table versions that go into each play's xwp fingerprint (see rerun-xwp.py)
+xwp_versions = (models.path('outcome_given_hit'),
+                models.path('base_adv'),
+                models.path('wp_table'))
 
 # get p(bip outcome | theta, ev, la, hit)
 X = df.select('home_team','hc_dist','theta','launch_speed','launch_angle').collect().to_numpy()
@@ -161,12 +166,9 @@ df = df.with_columns(out_prob=pl.when(cl('out_prob').is_not_null())
                                 .otherwise(if_out_prob),
                      **dict(zip(['p_1b','p_2b','p_3b','p_hr'],pred_outcome.T)))
 
-xwp_cols = ('inn_ind','half_ind','outs_when_up','base_cd','run_diff',
-            'theta','launch_speed','launch_angle',
-            'out_prob','p_1b','p_2b','p_3b','p_hr')
-
-curry = lambda r: row_wise_xwp(r,base_adv,wp_table)
-df = df.with_columns(xwp = pl.struct(xwp_cols).map_elements(curry,return_dtype=pl.Float64))
+df = df.collect()
+df = df.with_columns(xwp_fingerprint = xwp_fingerprint(*xwp_versions),
+                     xwp = batch_xwp(df,base_adv,wp_table))
 df = (df.with_columns(wpa_dir = 1-2*cl('half_ind'),
                       visra = cl('is_out')-cl('out_prob'),
                       scsra = cl('is_out')-cl('catch_rate'))
@@ -176,88 +178,23 @@ df = (df.with_columns(wpa_dir = 1-2*cl('half_ind'),
         .with_columns(wpali = pl.when(cl('li').eq(0)).then(0).otherwise(cl('wpa')/cl('li')),
                       wpoeli = pl.when(cl('li').eq(0)).then(0).otherwise(cl('wpoe')/cl('li'))))
 
-df = df.collect()
+# hive partitioned data, only the dates these games were played on get rewritten
+# so the plays from other games already on those dates get carried over
+kept = [compact.read_date(year,date) for year,date in df.select('game_year','game_date').unique().iter_rows()]
+kept = [k.filter(~cl('game_pk').is_in(df['game_pk'].unique().implode())) for k in kept if k is not None]
+df = pl.concat([df,*kept],how='diagonal_relaxed')
+print(f"writing {df['game_date'].n_unique()} dates, {len(df)-sum(map(len,kept))} new plays")
 
-# hive partitioned data
 df.write_parquet(f"{data_dir}/daily_data/",
                  use_pyarrow=True,
                  pyarrow_options={'partition_cols':['game_year','game_date'],
                                   'existing_data_behavior':'delete_matching'})
+# dates of compacted seasons just went back into partitions, fold them into the season files
+for year in set(df['game_year'].unique()) & set(compact.compacted_seasons()):
+    compact.compact(year)
 
+# only the dates just written get re-aggregated for the leaderboard
 con = duckdb.connect(data_dir / 'leaderboard.duckdb')
-con.execute(f"""
-    create or replace view all_plays as
-    select *
-    from read_parquet('data/daily_data/*/*/*.parquet',
-                      hive_partitioning=True);
-""")
-
-con.execute("""
-    create or replace table leaderboard as
-    with main_stats as (
-        select 
-            game_year as season,
-            resp_fielder_name as fielder_name,
-            count(*)          as plays,
-            sum(visra)        as vioaa,
-            sum(scsra)        as scoaa,
-            sum(wpoe)         as wpoe,
-            sum(wpoeli)       as wpoeli,
-            min(
-             date_diff('year',cast(resp_fielder_bday as date),make_date(game_year,7,1))
-            ) as age,
-            case
-             when count(distinct fld_team)=1 then min(fld_team)
-             else cast(count(distinct fld_team) as varchar) || 'TM'
-            end as team
-        from all_plays
-        where is_of_play
-        group by game_year,resp_fielder_name),
-    pos_counts as (
-        select
-            game_year          as season,
-            resp_fielder_name  as fielder_name,
-            resp_fielder       as pos_code,
-            count(*)           as cnt
-        from all_plays
-        where is_of_play
-        group by game_year, resp_fielder_name, resp_fielder),
-    primary_pos as (
-        select
-            season,
-            fielder_name,
-            pos_code as primary_pos_code
-        from (
-            select
-                season,
-                fielder_name,
-                pos_code,
-                cnt,
-                row_number()
-                    over(
-                        partition by season, fielder_name
-                        order by cnt desc, pos_code
-                    ) as rn
-            from pos_counts
-        )
-        where rn=1
-    )
-    select
-        main_stats.*,
-        primary_pos.primary_pos_code,
-        case primary_pos.primary_pos_code
-            when 2 then 'C'
-            when 3 then '1B'
-            when 4 then '2B'
-            when 5 then '3B'
-            when 6 then 'SS'
-            when 7 then 'LF'
-            when 8 then 'CF'
-            when 9 then 'RF'
-            else 'XX'
-        end as primary_position
-    from main_stats left join primary_pos using (season,fielder_name);
-""")
-
+leaderboard.refresh(con,dates=df['game_date'].unique().to_list())
 con.close()
 
@@ -1,11 +1,24 @@
-import numpy as np, polars as pl, requests, pathlib
+import numpy as np, polars as pl, requests, pathlib, sys, argparse, resource, os
+import pyarrow.parquet as pq
+sys.path.append(str(pathlib.Path(__file__).resolve().parent.parent))
 from wall import calc_wall_properties
 from player_info import get_player_bios
+from table_store import gather_state
 cl = pl.col
 data_dir = pathlib.Path(__file__).resolve().parent.parent / 'data'
-table_dir = pathlib.Path(__file__).resolve().parent.parent / 'tables'
 model_dir = pathlib.Path(__file__).resolve().parent.parent / 'models'
 
+''' Builds data/test-data-for-xwp-model.parquet from the full statcast pull, a chunk of dates at a time
+    (whole dates so games stay whole, never more than a month) sized so a chunk's working set fits in --memory-budget,
+    each chunk gets written out before the next one's read in
+'''
+
+parser = argparse.ArgumentParser()
+parser.add_argument('--memory-budget',type=float,default=4,help='GB the build should stay under')
+args = parser.parse_args()
+budget = args.memory_budget*2**30
+working_set = 4 # a chunk takes ~this many times its uncompressed size while it's being built (joins, sort, windows)
+
 bit_mapper = {'---': 0b000,
               '1--': 0b001,
               '-1-': 0b010,
@@ -15,22 +28,37 @@ bit_mapper = {'---': 0b000,
               '-11': 0b110,
               '111': 0b111}
 
-df        = pl.scan_parquet(data_dir / '2021-2024-sc-with-playid.parquet')
+sc_path   = data_dir / '2021-2024-sc-with-playid.parquet'
+out_path  = data_dir / 'test-data-for-xwp-model.parquet'
+sc_df     = pl.scan_parquet(sc_path)
 of_plays  = pl.scan_parquet(data_dir / '*-of-plays.parquet')
 fences_df = pl.read_parquet(data_dir / 'fences-lidar.parquet')
-wp_df     = pl.scan_parquet(table_dir / 'p(win|inn,half,base,out,rdiff).parquet')
-li_df     = pl.scan_parquet(table_dir / 'leverage-index.parquet')
 
-playerids = np.unique(df.select(*(cl(f'fielder_{i}') for i in range(2,10)),'batter','pitcher').collect().to_numpy())
+playerids = (sc_df.select(pl.concat_list(*(cl(f'fielder_{i}') for i in range(2,10)),'batter','pitcher')
+                            .explode().unique().drop_nulls().alias('id'))
+                  .collect(engine='streaming')['id'].to_numpy())
 player_df = get_player_bios(playerids)
 
-df = df.join(of_plays,on='play_id',how='left')
-
-wall_prop_dict = calc_wall_properties(df.filter(cl('start_pos_x').is_not_null()).collect(),fences_df)
-
-df = df.join(pl.LazyFrame(wall_prop_dict),on='play_id',how='left')
-
-game_state = ['inn_ind','half_ind','base_cd','outs_when_up','run_diff'] # for wp/li
+def plan_chunks(counts, max_rows):
+    ''' consecutive dates packed into chunks of at most max_rows, a chunk never spans months '''
+    chunks, cur, n = [], [], 0
+    for date,rows in counts.iter_rows():
+        if cur and (n+rows>max_rows or (date.year,date.month)!=(cur[0].year,cur[0].month)):
+            chunks.append(cur)
+            cur, n = [], 0
+        cur.append(date)
+        n += rows
+    if cur: chunks.append(cur)
+    return chunks
+
+meta = pq.ParquetFile(sc_path).metadata
+row_bytes = sum(meta.row_group(i).total_byte_size for i in range(meta.num_row_groups))/max(meta.num_rows,1)
+counts = (sc_df.group_by(game_date=cl('game_date').cast(pl.Date))
+               .agg(pl.len())
+               .sort('game_date')
+               .collect(engine='streaming'))
+chunks = plan_chunks(counts,max_rows=int(budget/(row_bytes*working_set)))
+print(f"{meta.num_rows} pitches, ~{row_bytes:.0f} bytes each, {len(chunks)} chunks")
 
 positions = ['pitcher', 'catcher', 
             'first base', 'second base', 'third base', 'shortstop',
@@ -42,76 +70,100 @@ outs = ['double_play','sac_bunt_dboule_play','fielders_choice',
 
 fielder_cols = [f'fielder_{i}' for i in range(2,10)]
 
-df = (df.with_columns(game_date=cl('game_date').dt.date(),
-                      fielder_name=cl('name_display_first_last'),
-                      resp_fielder = pl.when(cl('pos').is_null())
-                                       .then(pl.concat_list(cl('des').str.find(p) for p in positions).list.arg_min())
-                                       .otherwise('pos'),
-                      is_out = cl('events').is_in(outs),
-                      is_of_play = cl('start_pos_x').is_not_null(),
-                      inn_ind = (cl('inning')-1).clip(0,9),
-                      half_ind = (1-cl('inning_topbot').eq('Top')).cast(pl.Int64),
-                      run_diff = cl('home_score')-cl('away_score'),
-                      hc_x_ft = 2.495671*( cl('hc_x')-125.42), 
-                      hc_y_ft = 2.495671*(-cl('hc_y')+198.27), 
-                      base_state = pl.when(cl('on_1b').is_not_null()).then(pl.lit('1')).otherwise(pl.lit('-')) +
-                                   pl.when(cl('on_2b').is_not_null()).then(pl.lit('1')).otherwise(pl.lit('-')) +
-                                   pl.when(cl('on_3b').is_not_null()).then(pl.lit('1')).otherwise(pl.lit('-')),
-                      if_fielding_alignment=pl.when(cl('if_fielding_alignment').is_not_null())
-                                              .then('if_fielding_alignment')
-                                              .otherwise(pl.lit('Unknown')))
-        .with_columns(base_cd = cl('base_state').replace_strict(bit_mapper),
-                      fld_team = pl.when(cl('half_ind').eq(1)).then('away_team').otherwise('home_team'),
-                      theta = pl.arctan2('hc_x_ft','hc_y_ft'),
-                      hc_dist = (cl('hc_x_ft')**2+cl('hc_y_ft')**2)**0.5)
-        .sort('game_date','at_bat_number','pitch_number')
-        .with_columns(next_inn_ind = cl('inn_ind').shift(-1).over('game_pk'),
-                      next_half_ind = cl('half_ind').shift(-1).over('game_pk'),
-                      next_base_cd = cl('base_cd').shift(-1).over('game_pk'),
-                      next_outs_when_up = cl('outs_when_up').shift(-1).over('game_pk'),
-                      next_run_diff = cl('run_diff').shift(-1).over('game_pk'),
-                      backup_resp_fielder = pl.when((cl('hc_dist')>250) & (cl('theta') < -np.pi/6)).then(7)
-                                              .when((cl('hc_dist')>250) & cl('theta').is_between(-np.pi/6,np.pi/6)).then(8)
-                                              .when((cl('hc_dist')>250) & (cl('theta') > np.pi/6)).then(9)
-                                              .when(cl('hc_dist').is_between(10,250) & (cl('theta') < -np.pi/8)).then(5)
-                                              .when(cl('hc_dist').is_between(10,250) & cl('theta').is_between(-np.pi/8,0)).then(6)
-                                              .when(cl('hc_dist').is_between(10,250) & cl('theta').is_between(0,np.pi/8)).then(5)
-                                              .when(cl('hc_dist').is_between(10,250) & (cl('theta') > np.pi/8)).then(3)
-                                              .otherwise(2))
-        .with_columns(resp_fielder = pl.when(cl('resp_fielder').is_not_null())
-                                       .then('resp_fielder')
-                                       .otherwise('backup_resp_fielder'))
-        .with_columns(resp_fielder_id = pl.concat_list(f'fielder_{i}' for i in range(2,10)).list.get(cl('resp_fielder')-2))
-        .filter(cl('events').is_not_null(),cl('game_type').eq('R'))
-        .filter(cl('theta').is_not_null(),cl('launch_speed').is_not_null(),cl('launch_angle').is_not_null())
-        .join(player_df.lazy().select(cl('id').alias('resp_fielder_id'),
-                                      cl('fullName').alias('resp_fielder_name'),
-                                      cl('birthDate').alias('resp_fielder_bday')),
-              on='resp_fielder_id')
-        .join(wp_df,on=game_state,how='left')
-        .join(li_df,on=game_state,how='left')
-        .join(wp_df.rename({'wp':'next_wp'}),left_on=[f"next_{i}" for i in game_state],right_on=game_state,how='left')
-        .with_columns(next_wp = pl.when(cl('next_wp').is_not_null()).then('next_wp')
-                                  .when((cl('post_home_score')-cl('post_away_score'))>0).then(pl.lit(1.))
-                                  .when((cl('post_home_score')-cl('post_away_score'))<0).then(pl.lit(0.))
-                                  .otherwise(cl('wp').round())) # final otherwise only triggers in 1 instance: walk off balk
-        .select('play_id','game_date','game_year','home_team','away_team','fld_team','game_pk',
-                'inning','inning_topbot','outs_when_up','base_state','run_diff','balls','strikes',
-                'inn_ind','half_ind','base_cd','wp','li','next_wp','is_of_play','is_out',
-                'next_inn_ind','next_half_ind','next_base_cd','next_outs_when_up','next_run_diff',
-                cl('player_name').alias('pitcher_name'),'fielder_name','batter','pitcher','stand','events','des',
-                'theta','launch_speed','launch_angle','hc_x','hc_y','hc_x_ft','hc_y_ft','hc_dist',
-                'start_pos_x','start_pos_y','landing_pos_x','landing_pos_y','hang_time',
-                'fielder_2','fielder_3','fielder_4','fielder_5','fielder_6',
-                'fielder_7','fielder_8','fielder_9','if_fielding_alignment',
-                'resp_fielder','resp_fielder_id','resp_fielder_name','resp_fielder_bday',
-                'post_home_score','post_away_score','post_bat_score','post_fld_score',
-                'catch_rate', 'angle', 'dist', 'wall_dist_start', 'wall_dist_land', 
-                'wall_dist_ball_dir', 'wall_min_dist', 'wall_height'))
-
-df = df.collect()
-
-df.write_parquet(data_dir / 'test-data-for-xwp-model.parquet')
+def build_chunk(dates):
+    ''' the model data for the pitches on dates, lazily '''
+    df = sc_df.filter(cl('game_date').cast(pl.Date).is_between(dates[0],dates[-1]))
+    df = df.join(of_plays,on='play_id',how='left')
+
+    wall_prop_dict = calc_wall_properties(df.filter(cl('start_pos_x').is_not_null()).collect(engine='streaming'),fences_df)
+    df = df.join(pl.LazyFrame(wall_prop_dict),on='play_id',how='left')
+
+    df = (df.with_columns(game_date=cl('game_date').dt.date(),
+                          fielder_name=cl('name_display_first_last'),
+                          resp_fielder = pl.when(cl('pos').is_null())
+                                           .then(pl.concat_list(cl('des').str.find(p) for p in positions).list.arg_min())
+                                           .otherwise('pos'),
+                          is_out = cl('events').is_in(outs),
+                          is_of_play = cl('start_pos_x').is_not_null(),
+                          inn_ind = (cl('inning')-1).clip(0,9),
+                          half_ind = (1-cl('inning_topbot').eq('Top')).cast(pl.Int64),
+                          run_diff = cl('home_score')-cl('away_score'),
+                          hc_x_ft = 2.495671*( cl('hc_x')-125.42), 
+                          hc_y_ft = 2.495671*(-cl('hc_y')+198.27), 
+                          base_state = pl.when(cl('on_1b').is_not_null()).then(pl.lit('1')).otherwise(pl.lit('-')) +
+                                       pl.when(cl('on_2b').is_not_null()).then(pl.lit('1')).otherwise(pl.lit('-')) +
+                                       pl.when(cl('on_3b').is_not_null()).then(pl.lit('1')).otherwise(pl.lit('-')),
+                          if_fielding_alignment=pl.when(cl('if_fielding_alignment').is_not_null())
+                                                  .then('if_fielding_alignment')
+                                                  .otherwise(pl.lit('Unknown')))
+            .with_columns(base_cd = cl('base_state').replace_strict(bit_mapper),
+                          fld_team = pl.when(cl('half_ind').eq(1)).then('away_team').otherwise('home_team'),
+                          theta = pl.arctan2('hc_x_ft','hc_y_ft'),
+                          hc_dist = (cl('hc_x_ft')**2+cl('hc_y_ft')**2)**0.5)
+            .sort('game_date','at_bat_number','pitch_number')
+            .with_columns(next_inn_ind = cl('inn_ind').shift(-1).over('game_pk'),
+                          next_half_ind = cl('half_ind').shift(-1).over('game_pk'),
+                          next_base_cd = cl('base_cd').shift(-1).over('game_pk'),
+                          next_outs_when_up = cl('outs_when_up').shift(-1).over('game_pk'),
+                          next_run_diff = cl('run_diff').shift(-1).over('game_pk'),
+                          backup_resp_fielder = pl.when((cl('hc_dist')>250) & (cl('theta') < -np.pi/6)).then(7)
+                                                  .when((cl('hc_dist')>250) & cl('theta').is_between(-np.pi/6,np.pi/6)).then(8)
+                                                  .when((cl('hc_dist')>250) & (cl('theta') > np.pi/6)).then(9)
+                                                  .when(cl('hc_dist').is_between(10,250) & (cl('theta') < -np.pi/8)).then(5)
+                                                  .when(cl('hc_dist').is_between(10,250) & cl('theta').is_between(-np.pi/8,0)).then(6)
+                                                  .when(cl('hc_dist').is_between(10,250) & cl('theta').is_between(0,np.pi/8)).then(5)
+                                                  .when(cl('hc_dist').is_between(10,250) & (cl('theta') > np.pi/8)).then(3)
+                                                  .otherwise(2))
+            .with_columns(resp_fielder = pl.when(cl('resp_fielder').is_not_null())
+                                           .then('resp_fielder')
+                                           .otherwise('backup_resp_fielder'))
+            .with_columns(resp_fielder_id = pl.concat_list(f'fielder_{i}' for i in range(2,10)).list.get(cl('resp_fielder')-2))
+            .filter(cl('events').is_not_null(),cl('game_type').eq('R'))
+            .filter(cl('theta').is_not_null(),cl('launch_speed').is_not_null(),cl('launch_angle').is_not_null())
+            .join(player_df.lazy().select(cl('id').alias('resp_fielder_id'),
+                                          cl('fullName').alias('resp_fielder_name'),
+                                          cl('birthDate').alias('resp_fielder_bday')),
+                  on='resp_fielder_id')
+            .with_columns(wp = gather_state('wp'), # straight from the tables, null off the edge of them
+                          li = gather_state('li'),
+                          next_wp = gather_state('wp',prefix='next_'))
+            .with_columns(next_wp = pl.when(cl('next_wp').is_not_null()).then('next_wp')
+                                      .when((cl('post_home_score')-cl('post_away_score'))>0).then(pl.lit(1.))
+                                      .when((cl('post_home_score')-cl('post_away_score'))<0).then(pl.lit(0.))
+                                      .otherwise(cl('wp').round())) # final otherwise only triggers in 1 instance: walk off balk
+            .select('play_id','game_date','game_year','home_team','away_team','fld_team','game_pk',
+                    'inning','inning_topbot','outs_when_up','base_state','run_diff','balls','strikes',
+                    'inn_ind','half_ind','base_cd','wp','li','next_wp','is_of_play','is_out',
+                    'next_inn_ind','next_half_ind','next_base_cd','next_outs_when_up','next_run_diff',
+                    cl('player_name').alias('pitcher_name'),'fielder_name','batter','pitcher','stand','events','des',
+                    'theta','launch_speed','launch_angle','hc_x','hc_y','hc_x_ft','hc_y_ft','hc_dist',
+                    'start_pos_x','start_pos_y','landing_pos_x','landing_pos_y','hang_time',
+                    'fielder_2','fielder_3','fielder_4','fielder_5','fielder_6',
+                    'fielder_7','fielder_8','fielder_9','if_fielding_alignment',
+                    'resp_fielder','resp_fielder_id','resp_fielder_name','resp_fielder_bday',
+                    'post_home_score','post_away_score','post_bat_score','post_fld_score',
+                    'catch_rate', 'angle', 'dist', 'wall_dist_start', 'wall_dist_land', 
+                    'wall_dist_ball_dir', 'wall_min_dist', 'wall_height'))
+    return df
+
+# chunks get appended to one file (as row groups) that's only moved into place once it's all there
+tmp = out_path.with_suffix('.tmp')
+writer = None
+for i,dates in enumerate(chunks):
+    out = build_chunk(dates).collect(engine='streaming').to_arrow()
+    if writer is None:
+        writer = pq.ParquetWriter(tmp,out.schema)
+    writer.write_table(out.cast(writer.schema))
+    rss = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss*1024
+    print(f"{i+1:>3} of {len(chunks)}: {dates[0]} to {dates[-1]}, {out.num_rows} plays, peak rss {rss/2**30:.2f}GB")
+    del out
+if writer is not None:
+    writer.close()
+    os.replace(tmp,out_path)
+
+peak = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss*1024
+print(f"peak rss {peak/2**30:.2f}GB of a {args.memory_budget:g}GB budget" + (' (over!)' if peak>budget else ''))
+
 
 #for date, sub in lf.collect().group_by("game_date"):
 #    season = date.year
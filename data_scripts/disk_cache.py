@@ -0,0 +1,53 @@
+import polars as pl, json, pathlib, time, os
+
+''' Parquet files on disk keyed by a string (a game_pk, a date, ...), for data that doesn't change once it's final
+    cache.get_many(keys) -> {key: df} for the keys it has, cache.put(key, df), then cache.save() once at the end,
+    which drops the least recently used entries past max_bytes & writes the index (sizes & last use times)
+'''
+
+class ParquetCache:
+    def __init__(self, cache_dir, max_bytes):
+        self.dir        = pathlib.Path(cache_dir)
+        self.max_bytes  = max_bytes
+        self.index_path = self.dir / 'index.json'
+        self.index      = json.loads(self.index_path.read_text()) if self.index_path.exists() else {}
+
+    def path(self, key):
+        return self.dir / f"{key}.parquet"
+
+    def get(self, key):
+        if key not in self.index or not self.path(key).exists():
+            return None
+        self.index[key]['used'] = time.time()
+        return pl.read_parquet(self.path(key))
+
+    def get_many(self, keys):
+        found = {key: self.get(key) for key in keys}
+        return {key: df for key,df in found.items() if df is not None}
+
+    def put(self, key, df):
+        ''' written to a temp file & renamed, so an interrupted run never leaves half a file behind '''
+        self.dir.mkdir(parents=True,exist_ok=True)
+        tmp = self.path(key).with_suffix('.tmp')
+        df.write_parquet(tmp)
+        os.replace(tmp,self.path(key))
+        self.index[key] = {'bytes': self.path(key).stat().st_size, 'used': time.time()}
+
+    def drop(self, key):
+        self.path(key).unlink(missing_ok=True)
+        self.index.pop(key,None)
+
+    def size(self):
+        return sum(e['bytes'] for e in self.index.values())
+
+    def save(self):
+        total = self.size()
+        for key in sorted(self.index,key=lambda k: self.index[k]['used']):
+            if total<=self.max_bytes: break
+            total -= self.index[key]['bytes']
+            self.drop(key)
+        if self.index:
+            self.dir.mkdir(parents=True,exist_ok=True)
+            tmp = self.index_path.with_suffix('.tmp')
+            tmp.write_text(json.dumps(self.index))
+            os.replace(tmp,self.index_path)
@@ -1,32 +1,53 @@
-import numpy as np, polars as pl, requests
-from functools import lru_cache
+import numpy as np, polars as pl, pathlib, os
+from data_scripts.statsapi import fetch_all
 cl = pl.col
+data_dir = pathlib.Path(__file__).resolve().parent.parent / 'data'
+
+''' Outfield range plays (catch rate, sprint speed, hang time, ...) from savant, one request per fielder per season
+    they're kept per season in data/{year}-of-plays.parquet keyed by play_id, & each run only asks savant
+    about the outfielders in the statcast pull it's handed (i.e. the new games), merging their plays in
+'''
 
 def identify_outfielders(df):
     outfielders = np.unique(df.select('fielder_9','fielder_8','fielder_7').to_numpy().astype('f'))
     outfielders = outfielders[~np.isnan(outfielders)].astype(int)
     return outfielders
 
-@lru_cache
-def get_outfielder_plays(fielder,year):
-    url_dict = {'playerId': f"{fielder:0.0f}",
-                'season'  : year,
-                'playerType': 'fielder'}
-    url  = f"https://baseballsavant.mlb.com/player-services/range?" 
-    url += '&'.join(f'{i}={j}' for i,j in url_dict.items())
-    plays = requests.get(url, headers={'UserAgent':'Mozilla'}).json()
-    return plays
+def of_plays_path(year):
+    return data_dir / f"{year}-of-plays.parquet"
 
-def retrieve_of_plays(df):
-    outfielders = identify_outfielders(df)
-    year = df.select('game_year').unique()[0].item()
-    all_of_plays = []
-    for i,fielder in enumerate(outfielders):
-        print(f"{i+1:>5} of {len(outfielders):>5}")
-        plays = get_outfielder_plays(fielder,year)
-        all_of_plays += plays
-    of_plays = pl.DataFrame(all_of_plays).cast({'catch_rate':float,
-                                                'sprint_speed':float,
-                                                'hang_time':float})
+def range_url(fielder, year):
+    return f"https://baseballsavant.mlb.com/player-services/range?playerId={fielder:0.0f}&season={year}&playerType=fielder"
+
+def get_outfielder_plays(fielders, year):
+    ''' every range play of each fielder in the season, fetched concurrently '''
+    plays = [p for res in fetch_all(range_url(f,year) for f in fielders) for p in res]
+    if not plays:
+        return None
+    return pl.DataFrame(plays).cast({'catch_rate':float,
+                                     'sprint_speed':float,
+                                     'hang_time':float})
+
+def update_of_plays(fielders, year):
+    ''' merge the fielders' plays into the season's store, the fresh copy of a play wins '''
+    path = of_plays_path(year)
+    stored = pl.read_parquet(path) if path.exists() else None
+    new = get_outfielder_plays(fielders,year)
+    if new is None:
+        return stored
+    of_plays = new if stored is None else pl.concat([stored.filter(~cl('play_id').is_in(new['play_id'].implode())),new],
+                                                     how='diagonal_relaxed')
+    tmp = path.with_suffix('.tmp')
+    of_plays.write_parquet(tmp)
+    os.replace(tmp,path)
+    print(f"{year} of plays: {len(fielders)} fielders, {len(new)} plays fetched, {len(of_plays)} stored")
     return of_plays
 
+def retrieve_of_plays(df):
+    ''' the stored range plays for df's play_ids, after updating the store for df's outfielders '''
+    frames = []
+    for (year,), year_df in df.group_by('game_year'):
+        of_plays = update_of_plays(identify_outfielders(year_df),year)
+        if of_plays is not None:
+            frames.append(of_plays.filter(cl('play_id').is_in(year_df['play_id'].implode())))
+    return pl.concat(frames,how='diagonal_relaxed') if frames else pl.DataFrame(schema={'play_id':pl.String})
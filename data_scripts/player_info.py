@@ -1,9 +1,24 @@
-import numpy as np, requests, polars as pl
+import numpy as np, polars as pl, pathlib, os
+from data_scripts.statsapi import fetch_all
+cl = pl.col
+
+''' Player bios (id, fullName, birthDate) kept in data/players.parquet,
+    only ids that aren't in there yet get looked up (300 a request, all at once)
+'''
+
+players_path = pathlib.Path(__file__).resolve().parent.parent / 'data' / 'players.parquet'
+bio_schema   = {'id':pl.Int64,'fullName':pl.String,'birthDate':pl.String}
 
 def get_player_bios(ids):
-    people = []
-    for i in np.array_split(ids,len(ids)//300):
-        api_url = f"https://statsapi.mlb.com/api/v1/people?personIds={','.join(map(str,i))}"
-        res = requests.get(api_url,headers={'UserAgent':'Mozilla'}).json()
-        people += res['people']
-    return pl.DataFrame(people)
+    ids = [int(i) for i in np.unique(ids)]
+    players = pl.read_parquet(players_path) if players_path.exists() else pl.DataFrame(schema=bio_schema)
+    missing = sorted(set(ids)-set(players['id'].to_list()))
+    if missing:
+        paths = [f"people?personIds={','.join(map(str,missing[i:i+300]))}" for i in range(0,len(missing),300)]
+        people = [{k: p.get(k) for k in bio_schema} for res in fetch_all(paths) for p in res['people']]
+        players = pl.concat([players,pl.DataFrame(people,schema=bio_schema)]).unique('id',keep='last')
+        tmp = players_path.with_suffix('.tmp')
+        players.write_parquet(tmp)
+        os.replace(tmp,players_path)
+        print(f"player bios: {len(missing)} new ids, {len(players)} stored")
+    return players.filter(cl('id').is_in(ids))
@@ -1,13 +1,21 @@
-import numpy as np, polars as pl, pybaseball as pb, duckdb, requests, time, pathlib
-from functools import lru_cache
-pb.cache.enable()
+import numpy as np, polars as pl, duckdb, time, pathlib, datetime, os
+from concurrent.futures import ThreadPoolExecutor
+from data_scripts.statsapi import get_json, fetch_all
+from data_scripts.disk_cache import ParquetCache
 cl = pl.col
 here = pathlib.Path(__file__).resolve().parent
 
+# play_ids of final games never change, so they're kept on disk by game_pk (~15KB a game)
+playid_cache  = ParquetCache(here.parent / 'data' / 'playid-cache',max_bytes=256*2**20)
+playid_schema = {'game_pk':int,'at_bat_number':int,'play_id':str,'pa_pitch_number':int}
+
+# raw statcast pulls, one parquet per date in data/raw/statcast/game_date=yyyy-mm-dd/,
+# a date with every game over gets a _complete marker & is never pulled again
+raw_dir = here.parent / 'data' / 'raw' / 'statcast'
+
 def get_season_start_end_dates(start_year,end_year=None):
     if end_year is None: end_year = start_year
-    seasons_url = "https://statsapi.mlb.com/api/v1/seasons/all?sportId=1"
-    res = requests.get(seasons_url,headers={'UserAgent':'Mozilla'}).json()
+    res = get_json('seasons/all',sportId=1)
     seasons = pl.DataFrame(res['seasons']).cast({'seasonId':type(start_year)})
     start_date = seasons.filter(cl('seasonId').eq(start_year)).select('regularSeasonStartDate').item()
     end_date   = seasons.filter(cl('seasonId').eq(end_year)).select('regularSeasonEndDate').item()
@@ -16,8 +24,7 @@ def get_season_start_end_dates(start_year,end_year=None):
 def get_season_gamepks(season):
     start_date = get_season_start_end_dates(season)[0]
     end_date = time.strftime('%Y-%m-%d')
-    url = f"https://statsapi.mlb.com/api/v1/schedule?sportId=1&startDate={start_date}&endDate={end_date}"
-    res = requests.get(url,headers={'UserAgent':'Mozilla'}).json()
+    res = get_json('schedule',sportId=1,startDate=start_date,endDate=end_date)
     games = [g['gamePk'] for d in res['dates'] for g in d['games'] if g['status']['statusCode']=='F'
                                                                    and g['gameType']=='R']
     return np.unique(games)
@@ -34,44 +41,99 @@ def get_existing_gamepks(season):
     game_pks = [i[0] for i in game_pks]
     return game_pks
 
+def find_missing_gamepks(season):
+    existing_game_pks = set(get_existing_gamepks(season))
+    all_game_pks = get_season_gamepks(season)
+    return [i for i in all_game_pks if i not in existing_game_pks]
+
+def schedule_games(game_pks):
+    ''' the schedule entries of game_pks, looked up 200 games at a time, all fetched at once '''
+    paths = [f"schedule?sportId=1&gamePks={','.join(map(str,game_pks[i:i+200]))}"
+             for i in range(0,len(game_pks),200)]
+    return [g for res in fetch_all(paths) for d in res['dates'] for g in d['games']]
+
 def find_required_start_date():
     season = time.strftime('%Y')
-    existing_game_pks = get_existing_gamepks(season)
-    all_game_pks = get_season_gamepks(season)
-    game_pks = [i for i in all_game_pks if i not in existing_game_pks]
+    game_pks = find_missing_gamepks(season)
     if game_pks:
-        start_date = time.strftime('%Y-%m-%d')
-        s = len(game_pks)//200 if len(game_pks)>=200 else 1
-        for a in np.array_split(game_pks,s):
-            url = f"https://statsapi.mlb.com/api/v1/schedule?sportId=1&gamePks={','.join(map(str,a))}"
-            res = requests.get(url,headers={'UserAgent':'Mozilla'}).json()
-            min_start_date = min(g['officialDate'] for d in res['dates'] for g in d['games'] 
-                                                   if g['status']['statusCode']=='F')
-            start_date = min(start_date,min_start_date)
+        start_date = min([time.strftime('%Y-%m-%d')]+
+                         [g['officialDate'] for g in schedule_games(game_pks) if g['status']['statusCode']=='F'])
     else:
         start_date = get_season_start_end_dates(season)[0]
     return start_date
 
-def get_statcast():
-    start_date = find_required_start_date()
-    end_date = time.strftime('%Y-%m-%d')
-    season = time.strftime('%Y')
-    game_pks = get_existing_gamepks(season)
-    sc_data = pb.statcast(start_date,end_date)
-    sc_data = pl.from_pandas(sc_data)
-    # commenting this out because of how pyarrow deals with conflicting hive partitions
-    #sc_data = sc_data.filter(~cl('game_pk').is_in(game_pks))
+def raw_path(date):
+    return raw_dir / f"game_date={date}"
+
+def complete_dates(dates):
+    ''' {date: its final game_pks} for the dates whose scheduled games are all over (final, postponed or cancelled) '''
+    res = get_json('schedule',sportId=1,startDate=min(dates),endDate=max(dates))
+    return {d['date']: {g['gamePk'] for g in d['games'] if g['status']['statusCode']=='F'}
+            for d in res['dates'] if all(g['status']['abstractGameState']=='Final' for g in d['games'])}
+
+def pull_date(date, final_gpks=None):
+    ''' one date of statcast into the raw layer, written to a temp file & renamed
+        it's only marked complete (never pulled again) once it has every one of final_gpks,
+        statcast can be late with a game or two, those dates stay pending until it's caught up
+    '''
+    import pybaseball as pb # slow import, only needed when there's data to pull
+    sc_data = pl.from_pandas(pb.statcast(date,date,verbose=False))
+    path = raw_path(date)
+    path.mkdir(parents=True,exist_ok=True)
+    if len(sc_data):
+        tmp = path / 'statcast.tmp'
+        sc_data.with_columns(pl.selectors.by_dtype(pl.Null).cast(pl.String)).write_parquet(tmp)
+        os.replace(tmp,path / 'statcast.parquet')
+    if final_gpks is not None:
+        late = set(final_gpks) - (set(sc_data['game_pk'].to_list()) if len(sc_data) else set())
+        if late:
+            print(f"statcast: {date} is missing {len(late)} of its {len(final_gpks)} final games, left pending")
+        else:
+            (path / '_complete').touch()
+    return len(sc_data)
+
+def land_statcast(dates, workers=4):
+    ''' pull every date that isn't complete in the raw layer yet, a few at once '''
+    todo = [d for d in dates if not (raw_path(d) / '_complete').exists()]
+    if not todo:
+        return
+    complete = complete_dates(todo)
+    t0 = time.perf_counter()
+    with ThreadPoolExecutor(min(workers,len(todo))) as ex:
+        n = list(ex.map(lambda d: pull_date(d,complete.get(d)),todo))
+    print(f"statcast: pulled {len(todo)} dates ({sum(n)} pitches) in {time.perf_counter()-t0:.1f}s, "
+          f"{len(dates)-len(todo)} already landed")
+
+def scan_raw(dates):
+    ''' lazy scan of the raw layer for dates, days are lined up by column name since their dtypes can drift '''
+    files = [raw_path(d) / 'statcast.parquet' for d in dates if (raw_path(d) / 'statcast.parquet').exists()]
+    if not files:
+        return pl.LazyFrame(schema={'game_pk':pl.Int64,'at_bat_number':pl.Int64,'pitch_number':pl.Int64})
+    return pl.concat([pl.scan_parquet(f) for f in files],how='diagonal_relaxed')
+
+def get_statcast(game_pks=None):
+    ''' statcast pitches for game_pks, only landing the dates those games were played on,
+        or with no game_pks every game since the oldest one missing from the db
+    '''
+    if game_pks is None:
+        start = datetime.date.fromisoformat(find_required_start_date())
+        dates = [str(start+datetime.timedelta(days=i)) for i in range((datetime.date.today()-start).days+1)]
+    else:
+        dates = sorted({g['officialDate'] for g in schedule_games(game_pks)})
+    land_statcast(dates)
+    sc_data = scan_raw(dates)
+    if game_pks is not None:
+        sc_data = sc_data.filter(cl('game_pk').is_in(list(map(int,game_pks))))
     sc_data = (sc_data.sort('game_pk','at_bat_number','pitch_number')
                       .with_columns(pa_pitch_number=cl('at_bat_number')
                                                     .cum_count()
-                                                    .over('game_pk','at_bat_number')))
+                                                    .over('game_pk','at_bat_number'))
+                      .collect())
     return sc_data
 
-@lru_cache
-def retrieve_game_playids(gpk):
+def parse_playids(gpk, data):
+    ''' [game_pk, at_bat_number, play_id, pa_pitch_number] for every pitch of a playByPlay response '''
     plays = []
-    sa_url  = lambda x: f"https://statsapi.mlb.com/api/v1/game/{x}/playByPlay"
-    data = requests.get(sa_url(gpk),headers={'UserAgent':'Mozilla'}).json()
     for play in data['allPlays']:
         atBatIndex = play['atBatIndex']+1
         for event in play['playEvents']:
@@ -81,15 +143,24 @@ def retrieve_game_playids(gpk):
                 plays.append([gpk,atBatIndex,playId,pa_pitch_num])
     return plays
 
-def add_playids(sc_data):
-    rows = []
-    game_pks = sc_data.select('game_pk').unique().to_numpy().squeeze()
-    t0 = time.time()
-    for i,gpk in enumerate(game_pks):
-        print(f"{i+1:5} of {len(game_pks)} : time: {time.time()-t0:0.1f} {gpk}")
-        plays = retrieve_game_playids(gpk)
-        rows += plays
-    playid_df = pl.DataFrame(rows,schema={'game_pk':int,'at_bat_number':int,'play_id':str,'pa_pitch_number':int})
+def add_playids(sc_data, refresh=False):
+    ''' join play_ids onto the statcast pitches, only games that aren't in the play_id cache hit statsapi
+        (refresh re-fetches everything), & only final games get cached
+    '''
+    game_pks = sc_data['game_pk'].unique().to_list()
+    cached = {} if refresh else playid_cache.get_many(map(str,game_pks))
+    missing = [gpk for gpk in game_pks if str(gpk) not in cached]
+    responses = fetch_all(f"game/{gpk}/playByPlay" for gpk in missing)
+    final = {g['gamePk'] for g in schedule_games(missing) if g['status']['statusCode']=='F'} & set(missing)
+    frames = list(cached.values())
+    for gpk,data in zip(missing,responses):
+        df = pl.DataFrame(parse_playids(gpk,data),schema=playid_schema,orient='row')
+        if gpk in final:
+            playid_cache.put(str(gpk),df)
+        frames.append(df)
+    playid_cache.save()
+    print(f"play_ids: {len(cached)} games from the cache, {len(missing)} from statsapi ({len(final)} of them final)")
+    playid_df = pl.concat(frames) if frames else pl.DataFrame(schema=playid_schema)
     sc_data = sc_data.join(playid_df,on=['game_pk','at_bat_number','pa_pitch_number'])
     return sc_data
 
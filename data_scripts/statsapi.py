@@ -0,0 +1,70 @@
+import requests, threading, time, os
+from concurrent.futures import ThreadPoolExecutor
+from requests.adapters import HTTPAdapter
+from urllib3.util.retry import Retry
+
+''' One statsapi client for the data scripts, every request goes through the same keep-alive connection pool
+    get_json('schedule',sportId=1) for a single call, fetch_all(paths) for a lot of them at once
+    (a bounded number of threads, retries w/ backoff on connection errors & 429/5xx, & one rate limit across all threads)
+    STATSAPI_URL points it somewhere else, e.g. the replay server in statsapi_bench.py,
+    full urls (savant) go through the same pool & rate limit
+'''
+
+base_url    = os.environ.get('STATSAPI_URL','https://statsapi.mlb.com/api/v1')
+headers     = {'UserAgent':'Mozilla'}
+max_workers = 8
+max_rate    = 40  # requests/s, across all threads
+timeout     = 30
+
+class RateLimit:
+    ''' spaces calls out to at most rate per second, shared between threads '''
+    def __init__(self, rate):
+        self.interval = 1/rate if rate else 0.
+        self.lock     = threading.Lock()
+        self.next_t   = 0.
+
+    def wait(self):
+        with self.lock:
+            now = time.monotonic()
+            t = max(now,self.next_t)
+            self.next_t = t+self.interval
+        if t>now:
+            time.sleep(t-now)
+
+_session      = None
+_session_lock = threading.Lock()
+rate_limit    = RateLimit(max_rate)
+
+def session():
+    ''' the shared session, pool sized for max_workers so threads don't open throwaway connections '''
+    global _session
+    with _session_lock:
+        if _session is None:
+            retry = Retry(total=5,backoff_factor=0.5,status_forcelist=[429,500,502,503,504],
+                          allowed_methods=['GET'],respect_retry_after_header=True)
+            adapter = HTTPAdapter(pool_connections=2,pool_maxsize=max_workers,max_retries=retry)
+            s = requests.Session()
+            s.headers.update(headers)
+            s.mount('https://',adapter)
+            s.mount('http://',adapter)
+            _session = s
+    return _session
+
+def get_json(path, **params):
+    ''' GET base_url/path (path can carry its own query string, or be a full url) '''
+    rate_limit.wait()
+    url = path if '://' in path else f"{base_url}/{path}"
+    res = session().get(url,params=params or None,timeout=timeout)
+    res.raise_for_status()
+    return res.json()
+
+def fetch_all(paths, workers=max_workers):
+    ''' get_json for every path, concurrently, results come back in the same order '''
+    paths = list(paths)
+    if not paths:
+        return []
+    t0 = time.perf_counter()
+    with ThreadPoolExecutor(min(workers,max_workers,len(paths))) as ex:
+        results = list(ex.map(get_json,paths))
+    print(f"fetched {len(paths)} in {time.perf_counter()-t0:.1f}s")
+    return results
@@ -0,0 +1,86 @@
+import json, pathlib, random, sys, threading, time, argparse, requests
+from http.server import ThreadingHTTPServer, BaseHTTPRequestHandler
+sys.path.append(str(pathlib.Path(__file__).resolve().parent.parent))
+from data_scripts import statsapi
+from data_scripts.statcast import parse_playids
+
+''' Benchmark for the statsapi fetch layer against a local server replaying recorded responses
+    python data_scripts/statsapi_bench.py --record 745444 745445 ...   saves real playByPlay responses (needs network)
+    python data_scripts/statsapi_bench.py --latency 0.08               replays them, the old one-at-a-time requests.get
+                                                                       loop vs statsapi.fetch_all
+    with nothing recorded it makes up --synthetic games instead
+'''
+
+replay_dir = pathlib.Path(__file__).resolve().parent.parent / 'data' / 'statsapi-replay'
+
+def record(game_pks):
+    for gpk in game_pks:
+        f = replay_dir / f"game/{gpk}/playByPlay.json"
+        f.parent.mkdir(parents=True,exist_ok=True)
+        f.write_text(json.dumps(statsapi.get_json(f"game/{gpk}/playByPlay")))
+
+def synthetic_game(gpk):
+    ''' playByPlay shaped like the real thing, ~75 PAs of ~4 pitches '''
+    rng = random.Random(gpk)
+    return {'allPlays': [{'atBatIndex': ab,
+                          'playEvents': [{'isPitch': True, 'pitchNumber': p+1,
+                                          'playId': f"{gpk:x}-{ab}-{p}-{rng.getrandbits(64):016x}"}
+                                         for p in range(rng.randint(1,8))]}
+                         for ab in range(75)]}
+
+def serve(responses, latency):
+    ''' http server on a free port replaying {path: body}, every response held back by latency seconds '''
+    class Handler(BaseHTTPRequestHandler):
+        protocol_version = 'HTTP/1.1' # keep-alive
+        def do_GET(self):
+            time.sleep(latency)
+            body = responses.get(self.path.split('?')[0])
+            self.send_response(200 if body is not None else 404)
+            self.send_header('Content-Type','application/json')
+            self.send_header('Content-Length',str(len(body or b'')))
+            self.end_headers()
+            self.wfile.write(body or b'')
+        def log_message(self, *args):
+            pass
+    server = ThreadingHTTPServer(('127.0.0.1',0),Handler)
+    server.daemon_threads = True
+    threading.Thread(target=server.serve_forever,daemon=True).start()
+    return server
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser()
+    parser.add_argument('--record',type=int,nargs='+',help='game_pks to record from statsapi')
+    parser.add_argument('--latency',type=float,default=0.08,help='seconds per response, roughly a statsapi round trip')
+    parser.add_argument('--synthetic',type=int,default=300,help='made up games, when nothing is recorded')
+    parser.add_argument('--rate',type=float,default=statsapi.max_rate,help='requests/s limit for fetch_all, 0 for none')
+    args = parser.parse_args()
+    if args.record:
+        record(args.record)
+        sys.exit()
+
+    files = sorted(replay_dir.glob('game/*/playByPlay.json'))
+    if files:
+        responses = {f"/{f.relative_to(replay_dir).with_suffix('')}": f.read_bytes() for f in files}
+    else:
+        responses = {f"/game/{gpk}/playByPlay": json.dumps(synthetic_game(gpk)).encode()
+                     for gpk in range(745000,745000+args.synthetic)}
+    game_pks = [int(p.split('/')[2]) for p in responses]
+    server = serve(responses,args.latency)
+    statsapi.base_url = f"http://127.0.0.1:{server.server_port}"
+    statsapi.rate_limit = statsapi.RateLimit(args.rate)
+    print(f"{len(game_pks)} games, {args.latency*1000:.0f}ms latency, {'no' if not args.rate else args.rate} rate limit")
+
+    # the old way, a new connection per game, one after another
+    t0 = time.perf_counter()
+    old = [parse_playids(gpk,requests.get(f"{statsapi.base_url}/game/{gpk}/playByPlay",headers=statsapi.headers).json())
+           for gpk in game_pks]
+    t_old = time.perf_counter()-t0
+
+    t0 = time.perf_counter()
+    new = [parse_playids(gpk,data) for gpk,data in zip(game_pks,statsapi.fetch_all(f"game/{gpk}/playByPlay" for gpk in game_pks))]
+    t_new = time.perf_counter()-t0
+
+    assert old==new
+    print(f"sequential: {t_old:.2f}s ({len(game_pks)/t_old:.0f} games/s)")
+    print(f"fetch_all:  {t_new:.2f}s ({len(game_pks)/t_new:.0f} games/s), {t_old/t_new:.1f}x")
+    server.shutdown()
@@ -1,8 +1,8 @@
-import numpy as np, polars as pl, pickle as pkl
-from catboost import CatBoostClassifier
-from functools import lru_cache
-from utils import transition_mapper
+import numpy as np, polars as pl, logging, time, hashlib
+from utils import transition_mapper, file_hash
+from transition_table import transition_batch
 cl = pl.col
+logger = logging.getLogger(__name__)
 
 def xwp_given_outcome(inn,half,outs,base,rdiff,outcome,br_X,base_adv,wp_table):
     ''' Given the game state, a batted ball, & its outcome (out, single, double, etc.)
@@ -50,14 +50,11 @@ def xwp_given_outcome(inn,half,outs,base,rdiff,outcome,br_X,base_adv,wp_table):
                 new_half  = half if new_outs<3 else 1-half
                 new_base  = new_base if new_outs<3 else (2 if new_inn==9 else 0)
                 new_outs  = new_outs if new_outs<3 else 0
-                new_wp = wp_table[new_inn,new_half,new_base,new_outs,new_rdiff+max_rdiff]
+                new_wp = float(wp_table[new_inn,new_half,new_base,new_outs,new_rdiff+max_rdiff])
                 xwp += prob*new_wp
     return xwp
 
-rwxwp_count = 0
 def row_wise_xwp(row, base_adv, wp_table):
-    global rwxwp_count
-    rwxwp_count+=1
     inn   = row['inn_ind']
     half  = row['half_ind']
     outs  = row['outs_when_up']
@@ -73,6 +70,214 @@ def row_wise_xwp(row, base_adv, wp_table):
     xwp += p_2b*xwp_of_outcome('double')
     xwp += p_3b*xwp_of_outcome('triple')
     xwp += p_hr*xwp_of_outcome('home_run')
-    print(rwxwp_count, inn, half, outs, base, rdiff, xwp)
     return xwp
 
+
+def log_progress(stats):
+    ''' batch_xwp progress hook that reports through logging, use as batch_xwp(..., progress=log_progress)
+    '''
+    logger.info('xwp: %d/%d plays, %.0f plays/s, eta %.1fs, model %.2fs (%d rows), gather %.2fs',
+                stats['plays_done'],stats['plays_total'],stats['plays_per_sec'],stats['eta'],
+                stats['model_time'],sum(stats['model_rows'].values()),stats['gather_time'])
+
+# runner on each role's base, indexed by base_cd (0 means no runner in that role)
+lead_runner_base   = np.array([0,1,2,2,3,3,3,3])
+trail_runner_base  = np.array([0,0,0,1,0,1,2,2])
+trail2_runner_base = np.array([0,0,0,0,0,0,0,1])
+outcomes = ('out','single','double','triple','home_run')
+
+def next_state_index(inn,half,rdiff,new_outs,new_base,runs,shape):
+    ''' Vectorized version of the next game state lookup at the end of xwp_given_outcome,
+        returns flat indices into a (inn,half,base,outs,rdiff) table of the given shape,
+        with games that end on the play going to 2 extra states past its end: home loss then home win
+        run diffs past the table's edge read as its edge, all inputs must broadcast against each other
+    '''
+    max_rdiff = (shape[-1]-1)//2
+    new_rdiff = np.where(half==0,rdiff-runs,rdiff+runs)
+    game_over = (inn>=8) & (half==1) & (new_outs>2) & (new_rdiff!=0)
+    inn_over  = new_outs>2
+    new_inn   = np.minimum(np.where(inn_over & (half>0),inn+1,inn),9)
+    new_half  = np.where(inn_over,1-half,half)
+    new_base  = np.where(inn_over,np.where(new_inn==9,2,0),new_base)
+    new_outs  = np.where(inn_over,0,new_outs)
+    state = np.ravel_multi_index((new_inn,new_half,new_base,new_outs,new_rdiff+max_rdiff),shape,mode='clip')
+    return np.where(game_over,np.prod(shape)+(new_rdiff>0),state)
+
+def next_state_values(table, loss=0., win=1.):
+    ''' A (inn,half,base,outs,rdiff) table flattened to line up with next_state_index,
+        e.g. next_state_values(wp_table) or next_state_values(li_table,0.,0.)
+    '''
+    return np.append(table.ravel().astype(float),(loss,win))
+
+def _next_state_chunks(df, base_adv, shape, chunk_size, thread_count, progress):
+    ''' Does the work for batch_xwp & batch_next_states
+        yields (plays, p, state, runs), each (plays, outcome, advancement combo) shaped,
+        where p is the probability of the outcome & combo & state is from next_state_index
+    '''
+    t0 = time.perf_counter()
+    inn   = df['inn_ind'].to_numpy()
+    half  = df['half_ind'].to_numpy()
+    outs  = df['outs_when_up'].to_numpy()
+    base  = df['base_cd'].to_numpy()
+    rdiff = df['run_diff'].to_numpy()
+    br_X  = df.select('theta','launch_speed','launch_angle').to_numpy()
+    p_out = df['out_prob'].to_numpy()
+    p_outcome_given_hit = df.select('p_1b','p_2b','p_3b','p_hr').to_numpy()
+    p_outcome = np.column_stack((p_out,(1-p_out)[:,None]*p_outcome_given_hit))
+
+    # one model row per play, outcome & runner role, in that order
+    n, n_outcomes = len(df), len(outcomes)
+    codes = base_adv.classes_.astype(int)
+    C = len(codes)
+    role_bases = np.stack((lead_runner_base[base],trail_runner_base[base],trail2_runner_base[base]),axis=-1)
+    play, outcome, role = np.indices((n,n_outcomes,3)).reshape(3,-1)
+    has_runner = role_bases[play,role]>0
+    play, outcome, role = play[has_runner], outcome[has_runner], role[has_runner]
+    X = np.empty((len(play),4+br_X.shape[1]),dtype=object)
+    X[:,0] = outcome.astype(object)
+    X[:,1] = np.array(['lead','trail','trail2'],dtype=object)[role]
+    X[:,2] = role_bases[play,role].astype(object)
+    X[:,3] = outs[play].astype(object)
+    X[:,4:] = br_X[play]
+    probs = np.zeros((n,n_outcomes,3,C))
+    probs[...,0] = 1. # non-existent runners get all their weight on an (ignored) advancement code
+    if len(X):
+        probs[play,outcome,role] = base_adv.predict_proba(X,thread_count=thread_count)
+    stats = {'plays_done': 0, 'plays_total': n, 'plays_per_sec': 0., 'eta': float('nan'),
+             'model_calls': int(len(X)>0),
+             'model_rows': dict(zip(outcomes,np.bincount(outcome,minlength=n_outcomes).tolist())),
+             'model_time': time.perf_counter()-t0, 'gather_time': 0.}
+    if progress is not None:
+        progress(stats)
+
+    # find the next state of every advancement combination & its probability
+    combo_codes = codes[np.indices((C,C,C)).reshape(3,-1).T] # (lead, trail, trail2) codes of each combo
+    n_runners = (role_bases>0).sum(-1)
+    for k in range(4):
+        combos = np.arange(C**k)*C**(3-k) # only enumerate codes for the runners on base
+        rows   = np.where(n_runners==k)[0]
+        if not len(rows):
+            continue
+        for chunk in np.array_split(rows,-(-len(rows)//chunk_size) or 1):
+            t1      = time.perf_counter()
+            pr      = probs[chunk]
+            p_combo = np.ones((len(chunk),n_outcomes,1))
+            for r in range(k):
+                p_combo = (p_combo[...,None]*pr[:,:,r,None,:]).reshape(len(chunk),n_outcomes,-1)
+            new_outs, new_base, runs = transition_batch(outs[chunk,None,None],base[chunk,None,None],
+                                                        np.arange(n_outcomes)[:,None],combo_codes[combos])
+            state = next_state_index(inn[chunk,None,None],half[chunk,None,None],rdiff[chunk,None,None],
+                                     new_outs,new_base,runs,shape)
+            yield chunk, p_combo*p_outcome[chunk,:,None], state, np.broadcast_to(runs,state.shape)
+            if progress is not None and len(chunk):
+                elapsed = time.perf_counter()-t0
+                stats['plays_done']   += len(chunk)
+                stats['gather_time']  += time.perf_counter()-t1
+                stats['plays_per_sec'] = stats['plays_done']/elapsed
+                stats['eta']           = (n-stats['plays_done'])/stats['plays_per_sec']
+                progress(stats)
+
+def batch_xwp(df, base_adv, wp_table, chunk_size=50_000, thread_count=-1, progress=None):
+    ''' Same thing as row_wise_xwp, but for a whole dataframe at once
+        Every (play, outcome, runner) advancement probability is scored in one predict_proba call,
+        then the runner advancement combinations & their next state wps are gathered with numpy
+        (in chunks of chunk_size plays, the 3 runner case is 125 combos per outcome)
+        progress, if given, is called after the model call & each chunk with a dict of throughput stats:
+        plays_done, plays_total, plays_per_sec, eta, model_calls, model_rows (per outcome),
+        model_time & gather_time (seconds), see log_progress
+    '''
+    wp_values = next_state_values(wp_table)
+    xwp = np.zeros(len(df))
+    for chunk, p, state, runs in _next_state_chunks(df,base_adv,wp_table.shape,chunk_size,thread_count,progress):
+        xwp[chunk] = (p*wp_values[state]).sum((1,2))
+    return xwp
+
+def batch_next_states(df, base_adv, wp_table, chunk_size=50_000, thread_count=-1, progress=None):
+    ''' The whole next game state distribution of each play, rather than just its expected wp
+        Returned CSR style as (indptr, state, p, runs): play i's next states are
+        state[indptr[i]:indptr[i+1]] (see next_state_index) with probabilities p & runs scored on the play
+        Any per state quantity can then be averaged over it with expect_next_states, e.g.
+        xwp  = expect_next_states(ns, next_state_values(wp_table)[state])
+        runs = expect_next_states(ns, runs)
+    '''
+    n_states = wp_table.size+2
+    keys, ps = [], []
+    for chunk, p, state, runs in _next_state_chunks(df,base_adv,wp_table.shape,chunk_size,thread_count,progress):
+        # merge duplicate (play, state, runs) combos, runs are at most 4
+        key = (chunk[:,None,None]*n_states+state)*8+runs
+        key, inv = np.unique(key.ravel(),return_inverse=True)
+        keys.append(key)
+        ps.append(np.bincount(inv,weights=p.ravel(),minlength=len(key)))
+    if not keys:
+        return np.zeros(len(df)+1,dtype=int), np.zeros(0,dtype=int), np.zeros(0), np.zeros(0,dtype=int)
+    keys, ps = np.concatenate(keys), np.concatenate(ps)
+    order = np.argsort(keys,kind='stable')
+    keys, ps = keys[order], ps[order]
+    plays, state, runs = keys//8//n_states, keys//8%n_states, keys%8
+    indptr = np.searchsorted(plays,np.arange(len(df)+1))
+    return indptr, state, ps, runs
+
+def expect_next_states(next_states, values):
+    ''' Expectation over each play's next states of values, which has one value per next state entry
+    '''
+    indptr, state, p, runs = next_states
+    plays = np.repeat(np.arange(len(indptr)-1),np.diff(indptr))
+    return np.bincount(plays,weights=p*values,minlength=len(indptr)-1)
+
+# everything xwp depends on per play, p_1b etc. come from the outcome model so its inputs are used instead
+xwp_input_cols = ['home_team','hc_dist','theta','launch_speed','launch_angle',
+                  'inn_ind','half_ind','outs_when_up','base_cd','run_diff','out_prob']
+
+def xwp_fingerprint(*version_paths):
+    ''' Polars expression for a per-play fingerprint of the xwp inputs,
+        combined with the content hashes of the models/tables in version_paths
+        (& the polars version, since its hash isn't guaranteed stable across releases)
+    '''
+    version = hashlib.sha256(''.join(map(file_hash,version_paths)).encode()+pl.__version__.encode()).hexdigest()
+    return pl.struct(*xwp_input_cols,pl.lit(version).alias('version')).hash(seed=0)
+
+if __name__ == '__main__':
+    # regression check: python expected_win_probability.py [advancement model .cbm]
+    # batch_xwp against row_wise_xwp on frames with runner count groups missing (they used to crash),
+    # without a model a fixed advancement distribution that depends on the batted ball stands in for it
+    import sys, pathlib
+    class FixedAdvancement:
+        classes_ = np.array([-1,0,1,2,3])
+        def predict_proba(self, X, thread_count=-1):
+            X2 = np.atleast_2d(np.asarray(X,dtype=object))
+            e = np.exp(np.outer(X2[:,5].astype(float)/100,np.arange(5)) - X2[:,2].astype(float)[:,None])
+            p = e/e.sum(1,keepdims=True)
+            return p[0] if np.ndim(X)==1 else p # a single row comes back 1d, like catboost
+    if len(sys.argv)>1:
+        from catboost import CatBoostClassifier
+        base_adv = CatBoostClassifier().load_model(sys.argv[1])
+    else:
+        base_adv = FixedAdvancement()
+    wp_table = np.load(pathlib.Path(__file__).resolve().parent / 'tables' / 'p(win|inn,half,base,out,rdiff).npy')
+    rng = np.random.default_rng(0)
+    def plays(n, bases):
+        p_hit = rng.dirichlet(np.ones(4),n)
+        return pl.DataFrame({'inn_ind': rng.integers(0,10,n), 'half_ind': rng.integers(0,2,n),
+                             'outs_when_up': rng.integers(0,3,n), 'base_cd': rng.choice(bases,n),
+                             'run_diff': rng.integers(-10,11,n), 'theta': rng.uniform(-45,45,n),
+                             'launch_speed': rng.uniform(60,110,n), 'launch_angle': rng.uniform(-20,50,n),
+                             'out_prob': rng.uniform(0,1,n), 'p_1b': p_hit[:,0], 'p_2b': p_hit[:,1],
+                             'p_3b': p_hit[:,2], 'p_hr': p_hit[:,3]})
+    cases = {'empty frame':      plays(0,[0]),
+             'one bases empty':  plays(1,[0]),
+             'no bases loaded':  plays(50,np.arange(7)),
+             'every base state': plays(200,np.arange(8))}
+    for name,df in cases.items():
+        xwp = batch_xwp(df,base_adv,wp_table)
+        indptr, state, p, runs = batch_next_states(df,base_adv,wp_table)
+        expected = np.array([row_wise_xwp(row,base_adv,wp_table) for row in df.iter_rows(named=True)])
+        assert xwp.shape==(len(df),) and len(indptr)==len(df)+1
+        assert np.allclose(xwp,expected,atol=1e-12)
+        assert np.allclose(expect_next_states((indptr,state,p,runs),next_state_values(wp_table)[state]),expected)
+        print(f"{name}: {len(df)} plays ok")
+    # run diffs past the table's edge stay on their own side of it
+    shape = wp_table.shape
+    max_rdiff = (shape[-1]-1)//2
+    lead, trail = next_state_index(0,0,np.array([max_rdiff+5,-max_rdiff-5]),1,0,0,shape)
+    assert (lead, trail) == (np.ravel_multi_index((0,0,0,1,2*max_rdiff),shape),np.ravel_multi_index((0,0,0,1,0),shape))
+    print('out of range run diffs clip to the table edge')
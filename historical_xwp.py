@@ -1,35 +1,23 @@
-import numpy as np, polars as pl, pickle as pkl, pathlib, duckdb
-from catboost import CatBoostClassifier
-from functools import lru_cache
-from utils import transition_mapper
-from expected_win_probability import row_wise_xwp
+import polars as pl, pathlib, duckdb
+import model_registry as models, leaderboard, compact
+from expected_win_probability import batch_xwp, xwp_fingerprint
 cl = pl.col
 data_dir  = pathlib.Path(__file__).resolve().parent / 'data'
-model_dir = pathlib.Path(__file__).resolve().parent / 'models'
-table_dir = pathlib.Path(__file__).resolve().parent / 'tables'
 
 ''' File for filling in the past years of the leaderboard with data
 '''
 
 df = pl.scan_parquet(data_dir / 'test-data-for-xwp-model.parquet')
 
-# load in the models
-with open(model_dir / 'outcome-given-hit.pkl','rb') as f: 
-    outcome_given_hit = pkl.load(f)
+# models & win prob table, loaded on first use
+outcome_given_hit = models.get('outcome_given_hit')
+catch_prob        = models.get('catch_prob') # OF catch prob model
+out_prob          = models.get('out_prob') # IF out prob model
 
-# OF catch prob model
-with open(model_dir / 'catch-prob.pkl','rb') as f: 
-    catch_prob = pkl.load(f)
-
-# IF out prob model
-with open(model_dir / 'out-prob.pkl','rb') as f: 
-    out_prob = pkl.load(f)
-
-# Baserunner advancement model
-base_adv = CatBoostClassifier().load_model(model_dir / 'baserunner-advancement.cbm')
-
-# win prob table
-wp_table = np.load(table_dir / 'p(win|inn,half,base,out,rdiff).npy')
+# model/table versions that go into each play's xwp fingerprint (see rerun-xwp.py)
+xwp_versions = (models.path('outcome_given_hit'),
+                models.path('base_adv'),
+                models.path('wp_table'))
 
 # get p(bip outcome | theta, ev, la, hit)
 X = df.select('home_team','hc_dist','theta','launch_speed','launch_angle').collect().to_numpy()
@@ -54,12 +42,10 @@ df = df.with_columns(out_prob=pl.when(cl('out_prob').is_not_null())
                                 .otherwise(if_out_prob),
                      **dict(zip(['p_1b','p_2b','p_3b','p_hr'],pred_outcome.T)))
 
-cols = ('inn_ind','half_ind','outs_when_up','base_cd','run_diff',
-        'theta','launch_speed','launch_angle',
-        'out_prob','p_1b','p_2b','p_3b','p_hr')
-
-curry = lambda r: row_wise_xwp(r,base_adv,wp_table)
-df = df.with_columns(xwp = pl.struct(cols).map_elements(curry,return_dtype=pl.Float64))
+df = df.collect()
+xwp = batch_xwp(df,models.get('base_adv'),models.get('wp_table'))
+df = df.with_columns(xwp_fingerprint = xwp_fingerprint(*xwp_versions),
+                     xwp = xwp)
 df = (df.with_columns(wpa_dir = 1-2*cl('half_ind'),
                       visra = cl('is_out')-cl('out_prob'),
                       scsra = cl('is_out')-cl('catch_rate'))
@@ -69,12 +55,13 @@ df = (df.with_columns(wpa_dir = 1-2*cl('half_ind'),
         .with_columns(wpali = pl.when(cl('li').eq(0)).then(0).otherwise(cl('wpa')/cl('li')),
                       wpoeli = pl.when(cl('li').eq(0)).then(0).otherwise(cl('wpoe')/cl('li'))))
 
-df = df.collect()
-
 df.write_parquet(f"{data_dir}/daily_data/",
                  use_pyarrow=True,
                  pyarrow_options={'partition_cols':['game_year','game_date'],
                                   'existing_data_behavior':'delete_matching'})
+# dates of compacted seasons just went back into partitions, fold them into the season files
+for year in set(df['game_year'].unique()) & set(compact.compacted_seasons()):
+    compact.compact(year)
 
 #import matplotlib.pyplot as plt
 #f,ax = plt.subplots(2,1)
@@ -82,80 +69,7 @@ df.write_parquet(f"{data_dir}/daily_data/",
 #ax[1].scatter(*df.filter('is_of_play').select('xwp','next_wp').to_numpy().T,c=('dodgerblue',0.1),s=3)
 #plt.show()
 
+# only the rewritten dates get re-aggregated for the leaderboard
 con = duckdb.connect(data_dir / 'leaderboard.duckdb')
-con.execute(f"""
-    create or replace view all_plays as
-    select *
-    from read_parquet('data/daily_data/*/*/*.parquet',
-                      hive_partitioning=True);
-""")
-
-con.execute("""
-    create or replace table leaderboard as
-    with main_stats as (
-        select 
-            game_year as season,
-            resp_fielder_name as fielder_name,
-            count(*)          as plays,
-            sum(visra)        as vioaa,
-            sum(scsra)        as scoaa,
-            sum(wpoe)         as wpoe,
-            sum(wpoeli)       as wpoeli,
-            min(
-             date_diff('year',cast(resp_fielder_bday as date),make_date(game_year,7,1))
-            ) as age,
-            case
-             when count(distinct fld_team)=1 then min(fld_team)
-             else cast(count(distinct fld_team) as varchar) || 'TM'
-            end as team
-        from all_plays
-        where is_of_play
-        group by game_year,resp_fielder_name),
-    pos_counts as (
-        select
-            game_year          as season,
-            resp_fielder_name  as fielder_name,
-            resp_fielder       as pos_code,
-            count(*)           as cnt
-        from all_plays
-        where is_of_play
-        group by game_year, resp_fielder_name, resp_fielder),
-    primary_pos as (
-        select
-            season,
-            fielder_name,
-            pos_code as primary_pos_code
-        from (
-            select
-                season,
-                fielder_name,
-                pos_code,
-                cnt,
-                row_number()
-                    over(
-                        partition by season, fielder_name
-                        order by cnt desc, pos_code
-                    ) as rn
-            from pos_counts
-        )
-        where rn=1
-    )
-    select
-        main_stats.*,
-        primary_pos.primary_pos_code,
-        case primary_pos.primary_pos_code
-            when 2 then 'C'
-            when 3 then '1B'
-            when 4 then '2B'
-            when 5 then '3B'
-            when 6 then 'SS'
-            when 7 then 'LF'
-            when 8 then 'CF'
-            when 9 then 'RF'
-            else 'XX'
-        end as primary_position
-    from main_stats left join primary_pos using (season,fielder_name);
-""")
-
+leaderboard.refresh(con,dates=df['game_date'].unique().to_list())
 con.close()
-
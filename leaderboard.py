@@ -0,0 +1,134 @@
+import time, glob
+
+''' The all_plays view & the leaderboard table in leaderboard.duckdb
+    The leaderboard comes from fielder_daily, OF play aggregates per (date, season, fielder, position, team),
+    so after rewriting some dates only those dates get re-aggregated (duckdb only reads their partitions)
+    & the leaderboard is rebuilt from the small table. refresh(con) with no dates re-aggregates everything
+'''
+
+plays_glob  = 'data/daily_data/*/*/*.parquet'
+season_glob = 'data/season_data/*.parquet' # closed seasons, see compact.py
+
+def plays_sql():
+    ''' every play, from the per day partitions & the compacted season files '''
+    sources = []
+    if glob.glob(plays_glob):
+        sources.append(f"""
+        select *
+        from read_parquet('{plays_glob}',
+                          hive_partitioning=True,
+                          union_by_name=True)""")
+    if glob.glob(season_glob):
+        sources.append(f"""
+        select *
+        from read_parquet('{season_glob}',
+                          union_by_name=True)""")
+    if not sources:
+        raise FileNotFoundError(f"no plays to read, nothing matches {plays_glob} or {season_glob}")
+    return '\n        union all by name'.join(sources)
+
+def create_view(con):
+    con.execute(f"create or replace view all_plays as {plays_sql()};")
+
+def daily_aggs(where=''):
+    ''' OF play aggregates per (date, season, fielder, position, team) from all_plays '''
+    return f"""
+        select
+            game_date,
+            game_year         as season,
+            resp_fielder_name as fielder_name,
+            resp_fielder      as pos_code,
+            fld_team,
+            count(*)          as plays,
+            sum(visra)        as vioaa,
+            sum(scsra)        as scoaa,
+            sum(wpoe)         as wpoe,
+            sum(wpoeli)       as wpoeli,
+            min(
+             date_diff('year',cast(resp_fielder_bday as date),make_date(game_year,7,1))
+            ) as age
+        from all_plays
+        where is_of_play {where}
+        group by all
+    """
+
+def refresh(con, dates=None):
+    ''' view, per day aggregates for dates (None for everything) & the leaderboard from them '''
+    t0 = time.perf_counter()
+    create_view(con)
+    if not con.execute("select count(*) from information_schema.tables where table_name='fielder_daily'").fetchone()[0]:
+        dates = None # first run, nothing to merge into
+    if dates is None:
+        con.execute(f"create or replace table fielder_daily as {daily_aggs()}")
+    else:
+        # a literal list so duckdb can skip the other dates' partitions
+        in_dates = 'game_date in (' + ','.join(f"'{d}'::date" for d in sorted(set(dates))) + ')'
+        con.execute("begin transaction")
+        con.execute(f"delete from fielder_daily where {in_dates}")
+        con.execute(f"insert into fielder_daily {daily_aggs('and '+in_dates)}")
+        con.execute("commit")
+
+    con.execute("""
+        create or replace table leaderboard as
+        with main_stats as (
+            select
+                season,
+                fielder_name,
+                sum(plays)::bigint as plays,
+                sum(vioaa)        as vioaa,
+                sum(scoaa)        as scoaa,
+                sum(wpoe)         as wpoe,
+                sum(wpoeli)       as wpoeli,
+                min(age)          as age,
+                case
+                 when count(distinct fld_team)=1 then min(fld_team)
+                 else cast(count(distinct fld_team) as varchar) || 'TM'
+                end as team
+            from fielder_daily
+            group by season,fielder_name),
+        pos_counts as (
+            select
+                season,
+                fielder_name,
+                pos_code,
+                sum(plays)::bigint as cnt
+            from fielder_daily
+            group by season, fielder_name, pos_code),
+        primary_pos as (
+            select
+                season,
+                fielder_name,
+                pos_code as primary_pos_code
+            from (
+                select
+                    season,
+                    fielder_name,
+                    pos_code,
+                    cnt,
+                    row_number()
+                        over(
+                            partition by season, fielder_name
+                            order by cnt desc, pos_code
+                        ) as rn
+                from pos_counts
+            )
+            where rn=1
+        )
+        select
+            main_stats.*,
+            primary_pos.primary_pos_code,
+            case primary_pos.primary_pos_code
+                when 2 then 'C'
+                when 3 then '1B'
+                when 4 then '2B'
+                when 5 then '3B'
+                when 6 then 'SS'
+                when 7 then 'LF'
+                when 8 then 'CF'
+                when 9 then 'RF'
+                else 'XX'
+            end as primary_position
+        from main_stats left join primary_pos using (season,fielder_name);
+    """)
+    n = 'all' if dates is None else len(dates)
+    print(f"leaderboard: re-aggregated {n} dates in {time.perf_counter()-t0:.2f}s")
@@ -0,0 +1,37 @@
+import numpy as np
+
+''' Raw (unscaled) leverage index straight from the wp table & the base-out transition matrix
+    li = sum over next states of p(next state)*|wp(next state)-wp(state)|
+    see leverage_index_table.py for the scaling
+'''
+
+def next_state_list(T):
+    ''' the nonzero transitions of T (base, outs, new_base, new_outs, runs) per (base, outs),
+        padded to the same length with p=0 entries, each of shape (8, 3, k)
+    '''
+    n_b, n_o = T.shape[:2]
+    nz    = T.reshape(n_b,n_o,-1)!=0
+    k     = nz.sum(-1).max()
+    # nonzero flat indices first (in np.where order), padding after
+    order = np.argsort(~nz,axis=-1,kind='stable')[...,:k]
+    p     = np.take_along_axis(T.reshape(n_b,n_o,-1),order,axis=-1)
+    new_base, new_outs, runs = np.unravel_index(order,T.shape[2:])
+    return new_base, new_outs, runs, p
+
+def raw_leverage_index(wp, T):
+    ''' li table the same shape as wp, with one gather over every state & next state '''
+    n_inn, n_half, n_b, n_o, n_r = wp.shape
+    max_rdiff = (n_r-1)//2
+    new_base, new_outs, runs, p = next_state_list(T)
+
+    inn   = np.arange(n_inn)[:,None,None,None,None,None]
+    half  = np.arange(n_half)[None,:,None,None,None,None]
+    rdiff = np.arange(n_r)[None,None,None,None,:,None]
+    new_base, new_outs, runs, p = (a[None,None,:,:,None,:] for a in (new_base,new_outs,runs,p))
+
+    # home team contribs positively to rdiff, the third out flips the half (& bumps the inning)
+    next_rdiff = np.clip(rdiff+np.where(half==1,runs,-runs),0,2*max_rdiff)
+    next_half  = np.where(new_outs==3,1-half,half)
+    next_inn   = np.where(next_half!=half,inn+1,inn).clip(0,n_inn-2)
+    wp_next    = wp[next_inn,next_half,new_base,new_outs%3,next_rdiff]
+    return (abs(wp_next-wp[...,None])*p).sum(-1).astype(wp.dtype)
@@ -0,0 +1,66 @@
+import pathlib, time, logging
+logger = logging.getLogger(__name__)
+
+''' Lazily loaded models & tables for the pipeline scripts
+    import model_registry as models; models.get('catch_prob') loads the model on first use
+    (only then importing catboost/sklearn) & hands back the same object after that.
+    The sha256 of every file that gets loaded is kept in models.provenance()
+'''
+
+here      = pathlib.Path(__file__).resolve().parent
+model_dir = here / 'models'
+table_dir = here / 'tables'
+
+def _load_pickle(path):
+    import pickle
+    with open(path,'rb') as f:
+        return pickle.load(f)
+
+def _load_catboost(path):
+    from catboost import CatBoostClassifier
+    return CatBoostClassifier().load_model(path)
+
+def _load_npy(path):
+    import numpy as np
+    return np.load(path,mmap_mode='r') # read-only & shared between processes, see table_store.py
+
+# name -> (file, loader)
+registry = {'outcome_given_hit': (model_dir / 'outcome-given-hit.pkl',              _load_pickle),
+            'catch_prob':        (model_dir / 'catch-prob.pkl',                     _load_pickle),
+            'out_prob':          (model_dir / 'out-prob.pkl',                       _load_pickle),
+            'base_adv':          (model_dir / 'baserunner-advancement.cbm',         _load_catboost),
+            'base_adv_no_sc':    (model_dir / 'baserunner-advancement-no-sc.cbm',   _load_catboost),
+            'wp_table':          (table_dir / 'p(win|inn,half,base,out,rdiff).npy', _load_npy)}
+
+_loaded = {}
+_hashes = {} # path -> (mtime_ns, size, sha256), so unchanged files only get hashed once
+
+def path(name):
+    return registry[name][0]
+
+def content_hash(name):
+    ''' sha256 of the file behind a registry entry '''
+    from utils import file_hash
+    p = path(name)
+    st = p.stat()
+    cached = _hashes.get(p)
+    if cached is None or cached[:2] != (st.st_mtime_ns,st.st_size):
+        cached = _hashes[p] = (st.st_mtime_ns,st.st_size,file_hash(p))
+    return cached[2]
+
+def get(name):
+    ''' the loaded model/table for name, loaded on the first call '''
+    if name not in _loaded:
+        p, loader = registry[name]
+        t0 = time.perf_counter()
+        _loaded[name] = loader(p)
+        logger.info('loaded %s from %s (sha256 %s) in %.2fs',
+                    name,p.name,content_hash(name)[:12],time.perf_counter()-t0)
+    return _loaded[name]
+
+def provenance():
+    ''' {name: {'path', 'sha256'}} for every model/table loaded so far '''
+    return {name: {'path': str(path(name)), 'sha256': content_hash(name)} for name in _loaded}
+
+def clear():
+    _loaded.clear()
@@ -9,7 +9,14 @@ data_dir = pathlib.Path('../data')
 model_dir = pathlib.Path('../models')
 
 #df = (pl.scan_parquet(data_dir / '2021-2024-sc-with-playid.parquet')
-df = (pl.scan_parquet(data_dir / 'daily_data', hive_partitioning=True)
+# the per day partitions & the compacted seasons (see compact.py), whichever of them have files
+sources = []
+if list((data_dir / 'daily_data').glob('*/*/*.parquet')):
+    sources.append(pl.scan_parquet(data_dir / 'daily_data',hive_partitioning=True,
+                                   missing_columns='insert',extra_columns='ignore'))
+if list((data_dir / 'season_data').glob('*.parquet')):
+    sources.append(pl.scan_parquet(data_dir / 'season_data' / '*.parquet'))
+df = (pl.concat(sources,how='diagonal_relaxed')
         .with_columns(bip_outcome = cl('events').replace_strict({'single':'single', 
                                                                  'double':'double',
                                                                  'triple':'triple', 
@@ -0,0 +1,28 @@
+import numpy as np
+
+''' p(runs rest of inning | base, outs) straight from the transition matrix
+    the half inning is an absorbing markov chain, the 24 base-out states are transient & 3 outs absorbs.
+    Runs never go down, so the distribution can be built up one run total at a time:
+    F_r = (I-A_0)^-1 (a_r + sum_k A_k F_{r-k})
+    where A_k is the k run transient->transient part of T & a_r the r run transitions into 3 outs
+'''
+
+def runs_to_end_of_inning(T, max_runs=14):
+    ''' T is p(new_base,new_out,run|base,out), shape (8, 3, 8, 4, k)
+        returns p(runs|base,out), shape (8, 3, max_runs+1), with the mass of max_runs or more in the last bucket
+    '''
+    n_b, n_o, _, _, n_k = T.shape
+    n = n_b*n_o
+    A = T[:,:,:,:n_o].reshape(n,n,n_k).transpose(2,0,1) # (runs, from, to)
+    a = T[:,:,:,n_o].sum(2).reshape(n,n_k)               # (from, runs)
+    # zero run transitions put another runner on or get an out, so I-A_0 is always invertible
+    M = np.linalg.inv(np.eye(n)-A[0])
+
+    F = np.zeros((max_runs+1,n))
+    for r in range(max_runs+1):
+        rhs = a[:,r].copy() if r<n_k else np.zeros(n)
+        for k in range(1,min(r,n_k-1)+1):
+            rhs += A[k]@F[r-k]
+        F[r] = M@rhs
+    F[-1] = 1-F[:-1].sum(0)
+    return F.T.reshape(n_b,n_o,max_runs+1)
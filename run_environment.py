@@ -0,0 +1,117 @@
+import numpy as np, polars as pl, json, pathlib, hashlib, time, argparse
+from functools import lru_cache
+import base_out_run_dist, win_probability_table, leverage_index_table
+from table_store import info, open_table, gather_state
+from utils import scan_retrosheet, retrosheet_path
+cl = pl.col
+
+''' WP & LI tables for a run environment, i.e. the run distributions (& extras home win%) from a slice of retrosheet
+    env_tables(seasons=(2023,), home_team='COL') builds them the first time & caches them,
+    in memory (lru) & on disk in tables/env/ (least recently used get evicted past max_disk_entries).
+    The cache is keyed by the env & the league tables it falls back on, so rebuilding those (tables.py) invalidates it,
+    and the retrosheet file is only needed to build an env that isn't cached yet
+'''
+
+here             = pathlib.Path(__file__).resolve().parent
+env_dir          = here / 'tables' / 'env'
+index_path       = env_dir / 'index.json'
+max_disk_entries = 64
+
+retro_cols = sorted({'game_id',*base_out_run_dist.retro_cols,
+                     *win_probability_table.retro_cols,*leverage_index_table.retro_cols})
+
+def env_filter(seasons=None, home_team=None):
+    ''' retrosheet game ids are home team (3 chars) + yyyymmdd + game number '''
+    f = pl.lit(True)
+    if seasons is not None:
+        f = f & cl('game_id').str.slice(3,4).cast(pl.Int64).is_in(list(seasons))
+    if home_team is not None:
+        f = f & cl('game_id').str.slice(0,3).eq(home_team)
+    return f
+
+def env_key(seasons=None, home_team=None):
+    ''' the env's params & the versions of the league tables it depends on '''
+    params = {'seasons': sorted(seasons) if seasons is not None else None, 'home_team': home_team}
+    versions = [info(name)['sha256'] for name in ('transition','run_dist','run_dist_need1')]
+    return hashlib.sha256(json.dumps([params,versions]).encode()).hexdigest()[:16], params
+
+def build_env_tables(seasons=None, home_team=None, retro_path=retrosheet_path):
+    ''' (wp, li) for the slice of retrosheet in the env,
+        base-out states the slice never saw use the league run distribution (& no extras games, the league extras win%)
+        an env with no games at all (e.g. a season the retrosheet file doesn't cover) is a ValueError, not the league tables
+    '''
+    league = scan_retrosheet(retro_path,columns=retro_cols)
+    retro  = league.filter(env_filter(seasons,home_team)).collect()
+    missing = sorted(set(seasons or ())-set(retro['game_id'].str.slice(3,4).cast(pl.Int64).unique().to_list()))
+    if retro.is_empty() or missing:
+        raise ValueError(f"no retrosheet games in {retro_path} for seasons={missing or seasons} home_team={home_team}")
+    retro  = retro.lazy()
+    pr, pr9 = base_out_run_dist.empirical_run_dists(retro)
+    pr  = np.where(pr.sum(-1,keepdims=True)>0,pr,open_table('run_dist'))
+    pr9 = np.where(pr9.sum(-1,keepdims=True)>0,pr9,open_table('run_dist_need1'))
+    p_xiw = win_probability_table.extra_inning_win_prob(retro)
+    if p_xiw is None:
+        p_xiw = win_probability_table.extra_inning_win_prob(league)
+    wp = win_probability_table.win_prob_table(pr,pr9,p_xiw)
+    li = leverage_index_table.leverage_index_frame(wp,open_table('transition'),retro)['li'].to_numpy().reshape(wp.shape)
+    return wp, li
+
+def _load_index():
+    return json.loads(index_path.read_text()) if index_path.exists() else {}
+
+def _save_index(index):
+    index_path.write_text(json.dumps(index,indent=1))
+
+def _env_files(key):
+    return [env_dir / f"{key}-{name}.npy" for name in ('wp','li')]
+
+@lru_cache(maxsize=16)
+def _env_tables(key, seasons, home_team):
+    index = _load_index()
+    files = _env_files(key)
+    if key in index and all(f.exists() for f in files):
+        tables = tuple(np.load(f,mmap_mode='r') for f in files)
+    else:
+        tables = build_env_tables(seasons,home_team)
+        env_dir.mkdir(exist_ok=True)
+        for f,t in zip(files,tables):
+            np.save(f,t)
+        index[key] = {'params': env_key(seasons,home_team)[1], 'used': time.time()}
+        # least recently used envs past the cap get dropped
+        for old in sorted(index,key=lambda k: index[k]['used'])[:-max_disk_entries]:
+            for f in _env_files(old):
+                f.unlink(missing_ok=True)
+            del index[old]
+    index[key]['used'] = time.time()
+    _save_index(index)
+    return tables
+
+def env_tables(seasons=None, home_team=None):
+    ''' (wp, li) for the env, same layout as the league tables in the table store
+        seasons is an iterable of years, home_team a retrosheet team code, None means all of them
+    '''
+    seasons = tuple(sorted(seasons)) if seasons is not None else None
+    key, _ = env_key(seasons,home_team)
+    return _env_tables(key,seasons,home_team)
+
+def gather_season_state(name, seasons, prefix='', season_col='game_year'):
+    ''' like table_store.gather_state, but each row looks up its own season's table ('wp' or 'li') '''
+    i = ('wp','li').index(name)
+    expr = pl.when(False).then(None)
+    for season in seasons:
+        expr = expr.when(cl(season_col).eq(season)).then(gather_state(name,prefix,table=env_tables((season,))[i]))
+    return expr
+
+if __name__ == '__main__':
+    # prebuild env tables, e.g. python run_environment.py --seasons 2021 2022 2023 2024 --each
+    parser = argparse.ArgumentParser()
+    parser.add_argument('--seasons',type=int,nargs='*')
+    parser.add_argument('--home-team')
+    parser.add_argument('--each',action='store_true',help='one env per season instead of one for all of them')
+    args = parser.parse_args()
+    if args.each and not args.seasons:
+        parser.error('--each needs --seasons')
+    for seasons in ([(s,) for s in args.seasons] if args.each else [args.seasons]):
+        t0 = time.perf_counter()
+        wp, li = env_tables(seasons,args.home_team)
+        print(f"seasons={seasons} home_team={args.home_team}: {time.perf_counter()-t0:.2f}s")
@@ -0,0 +1,68 @@
+import os, sys, time, pathlib, numpy as np, polars as pl
+import multiprocessing as mp
+from concurrent.futures import ProcessPoolExecutor
+from expected_win_probability import batch_xwp
+cl = pl.col
+
+''' Multi-core xWP, the play df is sharded by game date & each shard is scored by batch_xwp
+    in a process pool. Each worker loads the baserunner advancement model & the wp table once,
+    & has its catboost/polars/blas threads capped so the workers don't fight over the cores
+    Scaling hasn't been measured on a multi-core machine yet (only on a single core, where it can't help),
+    so none of the pipeline scripts use it until this file's benchmark has been run on one
+'''
+
+xwp_cols = ['inn_ind','half_ind','outs_when_up','base_cd','run_diff',
+            'theta','launch_speed','launch_angle',
+            'out_prob','p_1b','p_2b','p_3b','p_hr']
+thread_env_vars = ['POLARS_MAX_THREADS','OMP_NUM_THREADS','OPENBLAS_NUM_THREADS','MKL_NUM_THREADS']
+
+def _init_worker(model_path, wp_table_path, threads):
+    global base_adv, wp_table, thread_count
+    from catboost import CatBoostClassifier
+    base_adv     = CatBoostClassifier().load_model(model_path)
+    wp_table     = np.load(wp_table_path,mmap_mode='r') # every worker maps the same pages
+    thread_count = threads
+
+def _score_shard(shard):
+    return batch_xwp(shard,base_adv,wp_table,thread_count=thread_count)
+
+def sharded_xwp(df, model_path, wp_table_path, workers, shard_col='game_date', threads_per_worker=None):
+    ''' Same output as batch_xwp(df, ...), in the same row order, but computed by `workers` processes
+        df must be a (collected) DataFrame with shard_col & the xwp columns
+    '''
+    if threads_per_worker is None:
+        threads_per_worker = max(1,(os.cpu_count() or 1)//workers)
+    df = df.select(xwp_cols+[shard_col]).with_row_index('row')
+    shards = df.sort(shard_col,'row').partition_by(shard_col,maintain_order=True)
+    # workers are spawned (polars isn't fork safe), they read the thread caps from the env on import
+    old_env = {k: os.environ.get(k) for k in thread_env_vars}
+    os.environ.update({k: str(threads_per_worker) for k in thread_env_vars})
+    try:
+        with ProcessPoolExecutor(workers,mp_context=mp.get_context('spawn'),
+                                 initializer=_init_worker,
+                                 initargs=(str(model_path),str(wp_table_path),threads_per_worker)) as pool:
+            results = list(pool.map(_score_shard,(s.select(xwp_cols) for s in shards)))
+    finally:
+        for k,v in old_env.items():
+            if v is None: os.environ.pop(k)
+            else: os.environ[k] = v
+    xwp = np.empty(len(df))
+    for shard,res in zip(shards,results):
+        xwp[shard['row'].to_numpy()] = res
+    return xwp
+
+if __name__ == '__main__':
+    # scaling benchmark: python sharded_xwp.py [plays parquet] [model] [wp table]
+    here = pathlib.Path(__file__).resolve().parent
+    plays_path    = sys.argv[1] if len(sys.argv)>1 else here / 'data' / 'daily_data'
+    model_path    = sys.argv[2] if len(sys.argv)>2 else here / 'models' / 'baserunner-advancement.cbm'
+    wp_table_path = sys.argv[3] if len(sys.argv)>3 else here / 'tables' / 'p(win|inn,half,base,out,rdiff).npy'
+    df = pl.read_parquet(plays_path,hive_partitioning=True).drop_nulls(xwp_cols)
+    print(f"{len(df)} plays, {df['game_date'].n_unique()} dates, {os.cpu_count()} cores")
+    baseline = None
+    for workers in (w for w in (1,2,4,8) if w<=(os.cpu_count() or 1)):
+        t0  = time.perf_counter()
+        xwp = sharded_xwp(df,model_path,wp_table_path,workers)
+        dt  = time.perf_counter()-t0
+        baseline = baseline or dt
+        print(f"{workers} workers: {dt:7.2f}s  {len(df)/dt:9.0f} plays/s  speedup {baseline/dt:4.2f}x")
@@ -0,0 +1,91 @@
+import numpy as np, polars as pl, json, pathlib, os
+from utils import file_hash
+
+''' The tables in tables/ as a small versioned store
+    tables/manifest.json has each table's file, shape, dtype, what its axes are, index offsets
+    (run_diff is stored shifted by max_rdiff) & the sha256 of the file & of whatever it was built from.
+    open_table memory maps the .npy read-only, so every process reading a table
+    (pool workers, the streamlit app) shares the same pages instead of holding its own copy
+'''
+
+here          = pathlib.Path(__file__).resolve().parent
+store_dir     = here / 'tables'
+manifest_path = store_dir / 'manifest.json'
+
+game_state_axes = ['inn_ind','half_ind','base_cd','outs_when_up','run_diff']
+
+# name -> (file, axes)
+layouts = {'transition':     ('p(new_base,new_out,run|base,out).npy', ['base_cd','outs_when_up','new_base_cd','new_outs','runs']),
+           'run_dist':       ('p(runs|base,out).npy',                 ['base_cd','outs_when_up','runs']),
+           'run_dist_need1': ('p(runs|base,out,need1).npy',           ['base_cd','outs_when_up','runs']),
+           'wp':             ('p(win|inn,half,base,out,rdiff).npy',   game_state_axes),
+           'li':             ('leverage-index.npy',                   game_state_axes),
+           'wp_count':       ('p(win|inn,half,base,out,count,rdiff).npy',
+                              game_state_axes[:4]+['balls','strikes','run_diff'])}
+
+_manifest = {'mtime': None, 'tables': {}}
+_open     = {} # name -> (sha256, memmap)
+
+def manifest():
+    ''' {name: entry}, re-read whenever the manifest file changes '''
+    mtime = manifest_path.stat().st_mtime_ns if manifest_path.exists() else None
+    if mtime != _manifest['mtime']:
+        _manifest['tables'] = json.loads(manifest_path.read_text()) if mtime else {}
+        _manifest['mtime']  = mtime
+    return _manifest['tables']
+
+def info(name):
+    return manifest()[name]
+
+def table_path(name):
+    return store_dir / info(name)['file']
+
+def open_table(name):
+    ''' read-only memory mapped table, the same map is handed back until the table's version changes '''
+    entry = info(name)
+    if name not in _open or _open[name][0] != entry['sha256']:
+        _open[name] = (entry['sha256'],np.load(store_dir / entry['file'],mmap_mode='r'))
+    return _open[name][1]
+
+def save_table(name, table, source=None):
+    ''' write table to its file in tables/ & record it in the manifest,
+        source is a hash of whatever it was built from (see tables.py)
+    '''
+    table = np.asarray(table)
+    file, axes = layouts[name]
+    assert len(axes)==table.ndim, f"{name} should have {len(axes)} dims, got {table.ndim}"
+    np.save(store_dir / file,table)
+    tables = dict(manifest())
+    tables[name] = {'file':    file,
+                    'shape':   list(table.shape),
+                    'dtype':   table.dtype.str,
+                    'axes':    axes,
+                    # value + offset = index, run diffs are stored from -max_rdiff
+                    'offsets': {'run_diff': (table.shape[-1]-1)//2} if 'run_diff' in axes else {},
+                    'sha256':  file_hash(store_dir / file),
+                    'source':  source}
+    # write & swap so readers never see half a manifest
+    tmp = manifest_path.with_suffix('.json.tmp')
+    tmp.write_text(json.dumps(tables,indent=1))
+    os.replace(tmp,manifest_path)
+    return tables[name]
+
+def state_index(name, prefix=''):
+    ''' polars expression for the flat index into table name, from the columns named like its axes
+        (with prefix, e.g. 'next_'), null where any of them is null or off the edge of the table
+    '''
+    entry = info(name)
+    idx, ok = pl.lit(0,dtype=pl.Int64), pl.lit(True)
+    for axis,size in zip(entry['axes'],entry['shape']):
+        i   = pl.col(prefix+axis).cast(pl.Int64)+entry['offsets'].get(axis,0)
+        idx = idx*size+i
+        ok  = ok & i.is_between(0,size-1)
+    return pl.when(ok).then(idx)
+
+def gather_state(name, prefix='', table=None):
+    ''' table name looked up at every row's state, same as a left join against its long format version
+        table swaps in another array with name's layout (e.g. a run environment's wp, see run_environment.py)
+    '''
+    table = open_table(name) if table is None else table
+    assert list(np.shape(table))==info(name)['shape'], f"table doesn't have {name}'s layout"
+    return pl.lit(pl.Series(np.asarray(table).ravel())).gather(state_index(name,prefix))
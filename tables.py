@@ -0,0 +1,177 @@
+import json, argparse, pathlib, time, hashlib
+from functools import cache
+import model_registry as models
+import transition_matrix, base_out_run_dist, win_probability_table, leverage_index_table, count_win_probability
+from utils import file_hash, scan_retrosheet, retrosheet_path
+from table_store import layouts, open_table, save_table
+
+''' Builds the tables in tables/ as a dependency graph instead of running each script by hand
+    python tables.py build [--force] [step ...]
+    python tables.py status
+    python tables.py build wp_count   (the optional count-aware wp table)
+    Each step is keyed by the hashes of everything it reads (retrosheet, models, upstream tables & its own code),
+    so a step only reruns when one of those changed. The retrosheet file is scanned at most once per build,
+    projecting just the columns the steps need
+'''
+
+here          = pathlib.Path(__file__).resolve().parent
+table_dir     = here / 'tables'
+retro_path    = here / retrosheet_path
+manifest_path = table_dir / 'build-manifest.json'
+
+T_path   = table_dir / layouts['transition'][0]
+pr_path  = table_dir / layouts['run_dist'][0]
+pr9_path = table_dir / layouts['run_dist_need1'][0]
+wp_path  = table_dir / layouts['wp'][0]
+li_path  = table_dir / layouts['li'][0]
+wpc_path = table_dir / layouts['wp_count'][0]
+
+code = lambda *names: [here / n for n in names]
+
+@cache
+def retro_frame():
+    ''' the one retrosheet scan, every step's columns at once '''
+    cols = {*transition_matrix.retro_cols, *base_out_run_dist.retro_cols,
+            *win_probability_table.retro_cols, *leverage_index_table.retro_cols,
+            *count_win_probability.retro_cols}
+    return scan_retrosheet(retro_path,columns=cols).collect().lazy()
+
+# each builder gets its step's key, which goes in the table store's manifest as the tables' source
+def build_transition_matrix(source):
+    p_events, p_outcomes = transition_matrix.event_probs(retro_frame())
+    T = transition_matrix.transition_matrix(p_events,p_outcomes,models.get('base_adv_no_sc'))
+    save_table('transition',T,source=source)
+
+def build_run_dists(source):
+    pr, pr9 = base_out_run_dist.empirical_run_dists(retro_frame())
+    save_table('run_dist',pr,source=source)
+    save_table('run_dist_need1',pr9,source=source)
+
+def build_win_prob(source):
+    p_xiw = win_probability_table.extra_inning_win_prob(retro_frame())
+    wp = win_probability_table.win_prob_table(open_table('run_dist'),open_table('run_dist_need1'),p_xiw)
+    save_table('wp',wp,source=source)
+
+def build_leverage_index(source):
+    wp = open_table('wp')
+    li_df = leverage_index_table.leverage_index_frame(wp,open_table('transition'),retro_frame())
+    save_table('li',li_df['li'].to_numpy().reshape(wp.shape),source=source)
+
+def build_count_wp(source):
+    p_pitch = count_win_probability.pitch_probs(retro_frame())
+    _, p_outcomes = transition_matrix.event_probs(retro_frame())
+    p_xiw = win_probability_table.extra_inning_win_prob(retro_frame())
+    wpc = count_win_probability.count_wp_table(open_table('wp'),p_pitch,p_outcomes,p_xiw,models.get('base_adv_no_sc'))
+    save_table('wp_count',wpc,source=source)
+
+# the code each step runs, its own modules & the repo modules they import
+transition_code = code('transition_matrix.py','transition_table.py','expected_win_probability.py',
+                       'model_registry.py','utils.py','table_store.py')
+run_dist_code   = code('base_out_run_dist.py','run_distribution.py','utils.py','table_store.py')
+win_prob_code   = code('win_probability_table.py','win_probability_solver.py','utils.py','table_store.py')
+leverage_code   = code('leverage_index_table.py','leverage_index.py','utils.py','table_store.py')
+count_wp_code   = list(dict.fromkeys(code('count_win_probability.py','leverage_index.py')+transition_code+win_prob_code))
+
+# step -> files it reads, files it writes, builder
+steps = {'transition_matrix': {'inputs':  [retro_path,models.path('base_adv_no_sc')]+transition_code,
+                               'outputs': [T_path],
+                               'build':   build_transition_matrix},
+         'run_dists':         {'inputs':  [retro_path]+run_dist_code,
+                               'outputs': [pr_path,pr9_path],
+                               'build':   build_run_dists},
+         'win_prob':          {'inputs':  [retro_path,pr_path,pr9_path]+win_prob_code,
+                               'outputs': [wp_path],
+                               'build':   build_win_prob},
+         'leverage_index':    {'inputs':  [retro_path,wp_path,T_path]+leverage_code,
+                               'outputs': [li_path],
+                               'build':   build_leverage_index},
+         # optional, only built when asked for by name
+         'wp_count':          {'inputs':  [retro_path,models.path('base_adv_no_sc'),wp_path]+count_wp_code,
+                               'outputs': [wpc_path],
+                               'build':   build_count_wp,
+                               'optional': True}}
+
+default_steps = [s for s,step in steps.items() if not step.get('optional')]
+
+def upstream(name):
+    ''' steps whose outputs name reads '''
+    return [s for s,step in steps.items() if set(step['outputs']) & set(steps[name]['inputs'])]
+
+def build_order(names):
+    ''' names & everything upstream of them, dependencies first '''
+    order = []
+    def visit(name):
+        if name in order: return
+        for dep in upstream(name): visit(dep)
+        order.append(name)
+    for name in names: visit(name)
+    return order
+
+def load_manifest():
+    if manifest_path.exists():
+        return json.loads(manifest_path.read_text())
+    return {'files': {}, 'steps': {}}
+
+def cached_hash(manifest, path):
+    ''' file hash, only re-read when the file's mtime or size changed '''
+    st = path.stat()
+    key = str(path.relative_to(here))
+    cached = manifest['files'].get(key)
+    if cached is None or cached[:2] != [st.st_mtime_ns,st.st_size]:
+        cached = manifest['files'][key] = [st.st_mtime_ns,st.st_size,file_hash(path)]
+    return cached[2]
+
+def step_key(manifest, name):
+    h = hashlib.sha256()
+    for path in steps[name]['inputs']:
+        h.update(str(path.relative_to(here)).encode()+cached_hash(manifest,path).encode())
+    return h.hexdigest()
+
+def is_fresh(manifest, name):
+    ''' inputs unchanged since the last build, & the outputs are still what that build wrote '''
+    record = manifest['steps'].get(name)
+    if record is None or record['key'] != step_key(manifest,name):
+        return False
+    return all(path.exists() and cached_hash(manifest,path)==record['outputs'].get(str(path.relative_to(here)))
+               for path in steps[name]['outputs'])
+
+def build(names=None, force=False):
+    ''' rebuild the stale steps of names (default all but the optional ones) & anything upstream of them, returns the steps that ran
+        upstream steps always come first, so a step's key sees its inputs' new hashes
+    '''
+    manifest = load_manifest()
+    ran = []
+    try:
+        for name in build_order(names or default_steps):
+            if not force and is_fresh(manifest,name):
+                print(f"{name}: up to date")
+                continue
+            t0  = time.perf_counter()
+            key = step_key(manifest,name)
+            steps[name]['build'](key)
+            manifest['steps'][name] = {'key': key,
+                                       'outputs': {str(p.relative_to(here)): cached_hash(manifest,p)
+                                                   for p in steps[name]['outputs']}}
+            ran.append(name)
+            print(f"{name}: built in {time.perf_counter()-t0:.2f}s")
+    finally:
+        manifest_path.write_text(json.dumps(manifest,indent=1))
+    return ran
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser()
+    parser.add_argument('command',choices=['build','status'])
+    parser.add_argument('steps',nargs='*',help=f"steps to build (default all but wp_count): {', '.join(steps)}")
+    parser.add_argument('--force',action='store_true',help='rebuild even if nothing changed')
+    args = parser.parse_args()
+    if unknown := set(args.steps)-set(steps):
+        parser.error(f"unknown steps {', '.join(unknown)}")
+
+    if args.command=='build':
+        build(args.steps,force=args.force)
+    else:
+        manifest = load_manifest()
+        for name in build_order(args.steps or default_steps):
+            missing = [str(p.relative_to(here)) for p in steps[name]['inputs'] if not p.exists()]
+            state = f"missing {', '.join(missing)}" if missing else ('up to date' if is_fresh(manifest,name) else 'stale')
+            print(f"{name}: {state}")
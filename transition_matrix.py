@@ -1,6 +1,9 @@
 import numpy as np, polars as pl
-from catboost import CatBoostClassifier
-from utils import transition_mapper
+import model_registry as models
+from utils import scan_retrosheet
+from table_store import save_table
+from transition_table import transition_batch
+from expected_win_probability import lead_runner_base, trail_runner_base, trail2_runner_base
 cl = pl.col
 
 ''' Building up a transition probability matrix
@@ -12,81 +15,98 @@ cl = pl.col
                       p(runner adv | outcome,role,base,outs)
 '''
 
-def runner_adv_probs(base,outs,outcome_code,base_adv):
+roles = ('lead','trail','trail2')
+
+# transition components per advancement model, keyed by id (catboost models aren't hashable)
+_components = {}
+
+def advancement_probs(base_adv):
+    ''' p(adv code | outcome, role, base, outs) for every runner of every base state in one predict_proba call
+        shape (8 bases, 3 outs, 5 outcomes, 3 roles, n codes), runners that don't exist get all their mass on the first code
+    '''
+    n_codes = len(base_adv.classes_)
+    # the model's whole feature domain, (outcome, role, runner base, outs)
+    o, r, b, u = (i.ravel().tolist() for i in np.indices((5,3,3,3)))
+    X = np.array([o,[roles[i] for i in r],[i+1 for i in b],u],dtype=object).T
+    probs = base_adv.predict_proba(X).reshape(5,3,3,3,n_codes)
+
+    role_base = np.stack((lead_runner_base,trail_runner_base,trail2_runner_base),axis=-1)[:,None,None,:] # (8,1,1,3)
+    p = probs[np.arange(5)[:,None],np.arange(3),(role_base-1).clip(0),np.arange(3)[:,None,None]]
+    return np.where((role_base>0)[...,None],p,np.eye(n_codes)[0])
+
+def transition_components(base_adv):
+    ''' (T_k, T_bb, T_bip), the transition matrices given a strikeout, a walk & each in-play outcome
+        T = p_k*T_k + p_bb*T_bb + p_inplay*sum_o p_o*T_bip[o], memoized per model
+    '''
+    if id(base_adv) in _components:
+        return _components[id(base_adv)][1]
     codes = base_adv.classes_.astype(int)
-    lead_base = base.bit_length()
-    match base.bit_count():
-        case 0:
-            lead_probs   = {None:1} # means they don't exist with a probabilty of 1.
-            trail_probs  = {None:1}
-            trail2_probs = {None:1}
-        case 1:
-            lead_probs   = dict(zip(codes,base_adv.predict_proba([outcome_code,'lead',lead_base,outs])))
-            trail_probs  = {None:1}
-            trail2_probs = {None:1}
-        case 2:
-            trail_base   = (base & ~(1<<(lead_base-1))).bit_length()
-            lead_probs   = dict(zip(codes,base_adv.predict_proba([outcome_code,'lead',lead_base,outs])))
-            trail_probs  = dict(zip(codes,base_adv.predict_proba([outcome_code,'trail',trail_base,outs])))
-            trail2_probs = {None:1}
-        case 3:
-            lead_probs   = dict(zip(codes,base_adv.predict_proba([outcome_code,'lead',3,outs])))
-            trail_probs  = dict(zip(codes,base_adv.predict_proba([outcome_code,'trail',2,outs])))
-            trail2_probs = dict(zip(codes,base_adv.predict_proba([outcome_code,'trail2',1,outs])))
-    return lead_probs,trail_probs,trail2_probs
+    bases, outs = np.indices((8,3))
+
+    # runners stay put on a strikeout, walk forces are handled by transition_batch
+    T_k, T_bb = np.zeros((2,8,3,8,4,5))
+    for T_e, event in ((T_k,'out'),(T_bb,'walk')):
+        new_outs, new_base, runs = transition_batch(outs,bases,event,np.zeros(3,dtype=int))
+        T_e[bases,outs,new_base,new_outs,runs] = 1.
+
+    # every lead/trail/trail2 code combo for every (base, outs, outcome)
+    p = advancement_probs(base_adv)
+    p_adv = p[...,0,:,None,None]*p[...,1,None,:,None]*p[...,2,None,None,:] # (8,3,5,n,n,n)
+    adv   = np.stack(np.meshgrid(codes,codes,codes,indexing='ij'),axis=-1)  # (n,n,n,3)
+    b, u, o = bases[:,:,None,None,None,None], outs[:,:,None,None,None,None], np.arange(5)[:,None,None,None]
+    new_outs, new_base, runs = transition_batch(u,b,o,adv)
+    T_bip = np.zeros((5,8,3,8,4,5))
+    np.add.at(T_bip,(o,b,u,new_base,new_outs,runs),p_adv)
 
-df = pl.read_parquet('data/2021-2024-full-retrosheet.parquet')
-df = (df.rename({i: i.lower() for i in df.collect_schema().names()})
-        .filter(cl('game_type').eq('R'),cl('bat_event_fl').eq('T'),cl('inn_ct')<9)
-        .sort('game_id','inn_ct','bat_home_id','event_id')
-        .with_columns(is_k = cl('event_cd').eq(3),
-                      is_bb = cl('event_cd').is_in([14,15,16,17]),
-                      is_out = cl('event_cd').is_in([2,3,19]),
-                      is_1b = cl('event_cd').is_in([18,20]),
-                      is_2b = cl('event_cd').eq(21),
-                      is_3b = cl('event_cd').eq(22),
-                      is_hr = cl('event_cd').eq(23))
-        .with_columns(is_inplay = ~(cl('is_k') | cl('is_bb'))))
+    _components[id(base_adv)] = (base_adv,(T_k,T_bb,T_bip)) # holding the model keeps its id from being reused
+    return T_k, T_bb, T_bip
 
-p_events = df.select('is_k','is_bb','is_inplay').mean().to_numpy().squeeze()
-p_outcomes = df.filter('is_inplay').select('is_out','is_1b','is_2b','is_3b','is_hr').mean().to_numpy().squeeze()
+# retrosheet columns the event probabilities need
+retro_cols = ['game_type','bat_event_fl','inn_ct','event_cd']
 
-# Transition probability matrix
-# 8 start base states, 3 start out states, 
-# 8 end base states, 4 end out states, 5 run scoring states
-T = np.zeros((8,3,8,4,5))
+def event_probs(retro, by=None):
+    ''' p(event) for event ∈ {K,BB/HBP,in-play} & p(outcome | in-play) from a (lowercased) retrosheet frame
+        with by (e.g. 'season_id', which then has to be in the frame) it's (groups, p_events (n,3), p_outcomes (n,5))
+        & transition_matrix gives one T per group
+    '''
+    df = (retro.filter(cl('game_type').eq('R'),cl('bat_event_fl').eq('T'),cl('inn_ct')<9)
+               .with_columns(is_k = cl('event_cd').eq(3),
+                             is_bb = cl('event_cd').is_in([14,15,16,17]),
+                             is_out = cl('event_cd').is_in([2,3,19]),
+                             is_1b = cl('event_cd').is_in([18,20]),
+                             is_2b = cl('event_cd').eq(21),
+                             is_3b = cl('event_cd').eq(22),
+                             is_hr = cl('event_cd').eq(23))
+               .with_columns(is_inplay = ~(cl('is_k') | cl('is_bb'))))
 
-# Baserunner advancement model
-base_adv = CatBoostClassifier().load_model('models/baserunner-advancement-no-sc.cbm')
+    events   = ['is_k','is_bb','is_inplay']
+    outcomes = ['is_out','is_1b','is_2b','is_3b','is_hr']
+    probs = (df.group_by(by) if by is not None else df.group_by(pl.lit(0)))
+    probs = (probs.agg(*(cl(i).mean() for i in events),
+                       *(cl(i).filter('is_inplay').mean() for i in outcomes))
+                  .sort(by if by is not None else 'literal')
+                  .collect())
+    p_events, p_outcomes = probs.select(events).to_numpy(), probs.select(outcomes).to_numpy()
+    if by is None:
+        return p_events[0], p_outcomes[0]
+    return probs.select(by).to_series().to_list(), p_events, p_outcomes
 
-for bases in range(8):
-    for outs in range(3):
-        for event,p_event in enumerate(p_events):
-            match event:
-                case 0: # strikeout
-                    new_outs = outs+1
-                    new_bases = bases if new_outs<3 else 0
-                    runs = 0
-                    T[bases,outs,new_bases,new_outs,runs] += p_event
-                case 1: # walk
-                    new_outs,new_bases,runs = transition_mapper(outs,bases,'walk',[])
-                    T[bases,outs,new_bases,new_outs,runs] += p_event
-                case 2: # BIP
-                    for outcome,p_outcome in enumerate(p_outcomes):
-                        lead_probs,trail_probs,trail2_probs = runner_adv_probs(bases,outs,outcome,base_adv)
-                        for aL,pL in lead_probs.items():
-                            for aT,pT in trail_probs.items():
-                                for aT2,pT2 in trail2_probs.items():
-                                    p_adv = pL*pT*pT2
-                                    if p_adv==0:
-                                        continue
-                                    adv_codes = tuple(i for i in (aL, aT, aT2) if i is not None)
-                                    outcomes = ['out','single','double','triple','home_run']
-                                    new_outs, new_bases, runs = transition_mapper(outs,bases,outcomes[outcome],adv_codes)
-                                    new_bases = new_bases if new_outs<3 else 0
-                                    new_outs = min(3,new_outs)
-                                    T[bases,outs,new_bases,new_outs,runs] += p_adv*p_outcome*p_event
+def transition_matrix(p_events, p_outcomes, base_adv):
+    ''' Transition probability matrix
+        8 start base states, 3 start out states, 
+        8 end base states, 4 end out states, 5 run scoring states
+        p_events (..., 3) & p_outcomes (..., 5) can be stacked (e.g. per season) for a (..., 8,3,8,4,5) stack of T's,
+        the advancement model only gets scored once per model
+    '''
+    T_k, T_bb, T_bip = transition_components(base_adv)
+    p_events = np.moveaxis(np.asarray(p_events),-1,0)[...,None,None,None,None,None]
+    T_inplay = np.tensordot(np.asarray(p_outcomes),T_bip,axes=(-1,0))
+    return p_events[0]*T_k + p_events[1]*T_bb + p_events[2]*T_inplay
 
-# save it
-np.save('tables/p(new_base,new_out,run|base,out).npy',T)
+if __name__ == '__main__':
+    p_events, p_outcomes = event_probs(scan_retrosheet(columns=retro_cols))
+    # Baserunner advancement model
+    T = transition_matrix(p_events,p_outcomes,models.get('base_adv_no_sc'))
 
+    # save it
+    save_table('transition',T)
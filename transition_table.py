@@ -0,0 +1,48 @@
+import numpy as np
+from utils import transition_mapper
+
+''' transition_mapper precomputed over its whole (small) domain:
+    outs 0-2, 8 base states, 6 bat events & a (lead, trail, trail2) advancement code for each runner
+    Codes for runners that aren't on base are ignored, & any code outside of adv_codes
+    is treated by transition_mapper as the runner staying put, same as 0
+'''
+
+bat_events = ('out','single','double','triple','home_run','walk')
+adv_codes  = np.array([-1,0,1,2,3])
+
+def build_transition_table():
+    C = len(adv_codes)
+    shape = (3,8,len(bat_events),C,C,C)
+    new_outs, new_base, runs = (np.zeros(shape,dtype=np.int8) for _ in range(3))
+    for o,b,e,iL,iT,iT2 in np.ndindex(shape):
+        codes = (adv_codes[iL],adv_codes[iT],adv_codes[iT2])
+        new_outs[o,b,e,iL,iT,iT2],new_base[o,b,e,iL,iT,iT2],runs[o,b,e,iL,iT,iT2] = \
+            transition_mapper(o,b,bat_events[e],codes)
+    return new_outs, new_base, runs
+
+new_outs_table, new_base_table, runs_table = build_transition_table()
+
+def transition_batch(outs, base, event, codes):
+    ''' Vectorized transition_mapper, returns arrays of (new_outs, new_base, runs)
+        event can be bat_events strings or their indices, codes is (..., 3) with the
+        lead, trail, trail2 advancement codes (pad with 0 for runners that don't exist)
+        everything is broadcast against each other
+    '''
+    event = np.asarray(event)
+    if event.dtype.kind in 'UO':
+        event = np.vectorize(bat_events.index,otypes=[int])(event)
+    codes = np.asarray(codes)
+    ind   = np.searchsorted(adv_codes,codes).clip(0,len(adv_codes)-1)
+    ind   = np.where(adv_codes[ind]==codes,ind,np.searchsorted(adv_codes,0))
+    i = (outs,base,event,ind[...,0],ind[...,1],ind[...,2])
+    return new_outs_table[i], new_base_table[i], runs_table[i]
+
+if __name__ == '__main__':
+    # regression check, every entry of the table against the scalar function
+    for o,b,e,iL,iT,iT2 in np.ndindex(new_outs_table.shape):
+        codes = (adv_codes[iL],adv_codes[iT],adv_codes[iT2])
+        assert transition_batch(o,b,bat_events[e],codes) == transition_mapper(o,b,bat_events[e],codes)
+        n_runners = b.bit_count()
+        assert transition_batch(o,b,e,codes[:n_runners]+(0,)*(3-n_runners)) == \
+               transition_mapper(o,b,bat_events[e],codes[:n_runners])
+    print('transition table matches transition_mapper')
@@ -1,4 +1,5 @@
-import numpy as np, polars as pl, requests
+import numpy as np, polars as pl, requests, hashlib
+cl = pl.col
 
 headers = {'User-Agent': 'Mozilla/5.0'}
 
@@ -55,3 +56,36 @@ def transition_mapper(outs, base, bat_event, adv_codes):
         base = 0
     return outs, base, runs
 
+
+def file_hash(path, chunk_size=1<<20):
+    ''' sha256 of a file's contents, for tracking which model/table version produced something
+    '''
+    h = hashlib.sha256()
+    with open(path,'rb') as f:
+        while chunk := f.read(chunk_size):
+            h.update(chunk)
+    return h.hexdigest()
+
+retrosheet_path = 'data/2021-2024-full-retrosheet.parquet'
+
+def scan_retrosheet(path=retrosheet_path, columns=None):
+    ''' Lazy retrosheet frame with lowercased column names,
+        only projecting `columns` (lowercase) if they're given
+    '''
+    df = pl.scan_parquet(path)
+    names = df.collect_schema().names()
+    if columns is None:
+        return df.rename({i: i.lower() for i in names})
+    return df.select(cl(i).alias(i.lower()) for i in names if i.lower() in columns)
+
+def state_frame(table, col, max_rdiff=None):
+    ''' Flatten a (inn, half, base, outs, rdiff) table into one row per game state
+    '''
+    if max_rdiff is None: max_rdiff = (table.shape[-1]-1)//2
+    i, h, b, o, r = np.indices(table.shape, dtype=int)
+    return pl.DataFrame({'inn_ind': i.ravel(),
+                         'half_ind': h.ravel(),
+                         'base_cd': b.ravel(),
+                         'outs_when_up': o.ravel(),
+                         'run_diff': r.ravel()-max_rdiff,
+                         col: table.ravel()})
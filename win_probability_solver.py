@@ -0,0 +1,75 @@
+import numpy as np
+
+''' Backward induction for the win probability table, vectorized over every (base, outs) at once
+    wp[inn,half,base,outs,rdiff] is home team win prob, rdiff = home - away runs, clipped to +-max_rdiff
+    pr  is p(runs rest of half inning | base, outs), pr9 the same for when the batting team needs 1 run
+    p_xiw is the home team's win prob once a game gets to extras
+    solve_wp(pr,pr9,p_xiw) is bit-identical to the old looped win_probability_table.py
+'''
+
+def run_dist(pr, max_rinn):
+    ''' pr over runs 0..max_rinn, padded with zeros or with the tail lumped into the last bucket '''
+    k = pr.shape[-1]
+    if k<=max_rinn:
+        return np.concatenate((pr,np.zeros(pr.shape[:-1]+(max_rinn+1-k,))),axis=-1)
+    if k>max_rinn+1:
+        return np.concatenate((pr[...,:max_rinn],pr[...,max_rinn:].sum(-1,keepdims=True)),axis=-1)
+    return pr
+
+def rdiff_shift(max_rdiff, max_rinn):
+    ''' rdiff index after r runs score, [0] for the away team batting (top), [1] for home (bottom)
+        shape (2, 2*max_rdiff+1, max_rinn+1)
+    '''
+    rdiffs  = np.arange(-max_rdiff,max_rdiff+1)
+    rs      = np.arange(max_rinn+1)
+    rdr_ind = np.subtract.outer(rdiffs,rs).clip(-max_rdiff,max_rdiff)+max_rdiff
+    return np.stack((rdr_ind,max_rdiff*2-rdr_ind[::-1]))
+
+def half_inning(next_wp, pr, rdr_ind):
+    ''' wp for every (base, outs, rdiff) of a half inning, given the wp (over rdiff) at the start of the next one
+        this is next_wp[rdr_ind]@pr[b,o] for each b,o, done as one stacked matmul
+    '''
+    return np.matmul(next_wp[rdr_ind],pr[...,None])[...,0]
+
+def bottom_last(pr, pr9, p_xiw, max_rdiff):
+    ''' bottom of the last inning (& of extras), home team leading already won
+        p(win) = p(walkoff) + p(go to extras)*p(win in extras)
+    '''
+    n_b,n_o,k = pr.shape
+    wp = np.zeros((n_b,n_o,max_rdiff*2+1),dtype='f')
+    wp[...,max_rdiff+1:] = 1.
+    for rdiff in range(-max_rdiff,1): # at most 31 runs, each is a couple of (8,3) sums
+        if -rdiff>=k: continue # can't catch up, stays 0
+        cur_pr    = pr9 if rdiff in [-1,0] else pr
+        p_walkoff = cur_pr[...,-rdiff+1:].sum(-1)
+        p_extras  = cur_pr[...,-rdiff]
+        wp[...,max_rdiff+rdiff] = p_walkoff + p_extras*p_xiw
+    return wp
+
+def solve_wp(pr, pr9, p_xiw, max_rdiff=30, max_rinn=14, innings=9):
+    ''' win prob table, shape (innings+1, 2, 8, 3, 2*max_rdiff+1), float32
+        the last inning index is extras, where the top starts with a runner on second
+    '''
+    pr, pr9  = run_dist(pr,max_rinn), run_dist(pr9,max_rinn)
+    rdr_inds = rdiff_shift(max_rdiff,max_rinn)
+    need1    = slice(max_rdiff-1,max_rdiff+1) # the "need a run" run dist is used for these rdiffs
+    last     = innings-1
+
+    wp = np.zeros((innings+1,2)+pr.shape[:2]+(max_rdiff*2+1,),dtype='f')
+    wp[last,1] = bottom_last(pr,pr9,p_xiw,max_rdiff)
+    for i in range(last,-1,-1):
+        for h in [1,0]:
+            if h==1 and i==last:
+                continue
+            next_wp  = wp[i+h,1-h,0,0]
+            wp[i,h]  = half_inning(next_wp,pr,rdr_inds[h])
+            if i==last:
+                wp[i,h,...,need1] = half_inning(next_wp,pr9,rdr_inds[h])[...,need1]
+
+    # the bottom of extras is the same as the bottom of the last inning,
+    # the top starts the next inning with a runner on second
+    wp[-1,1] = wp[last,1]
+    next_wp  = wp[last,1,2,0]
+    wp[-1,0] = half_inning(next_wp,pr,rdr_inds[0])
+    wp[-1,0,...,need1] = half_inning(next_wp,pr9,rdr_inds[0])[...,need1]
+    return wp